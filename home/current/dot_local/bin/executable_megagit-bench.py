@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import importlib.util
+
+# Every synthetic repo is put into one of these states, round-robin.
+STATES = ['clean', 'dirty', 'ahead', 'behind', 'untracked']
+ACTIONS = ['init', 'fetch', 'pull', 'wip']
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'megagit-bench', 'GIT_AUTHOR_EMAIL': 'bench@example.invalid',
+    'GIT_COMMITTER_NAME': 'megagit-bench', 'GIT_COMMITTER_EMAIL': 'bench@example.invalid',
+    'GIT_CONFIG_NOSYSTEM': '1',
+}
+
+def find_megagit():
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in ('megagit.py', 'executable_megagit.py', 'megagit'):
+        path = os.path.join(here, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def git(*args, cwd=None):
+    subprocess.run(['git'] + list(args), cwd=cwd, check=True, capture_output=True, env={**os.environ, **GIT_ENV})
+
+def make_seed(base):
+    seed = os.path.join(base, 'seed')
+    git('init', '-q', '-b', 'main', seed)
+    for i in range(2):
+        with open(os.path.join(seed, 'README'), 'a') as f:
+            f.write(f"line {i}\n")
+        git('add', 'README', cwd=seed)
+        git('commit', '-q', '-m', f"commit {i}", cwd=seed)
+    return seed
+
+def make_fleet(base, size):
+    """Create `size` working repos under base/ws, each with a bare origin under base/origins."""
+    seed = make_seed(base)
+    workspace = os.path.join(base, 'ws')
+    os.makedirs(os.path.join(base, 'origins'))
+    for i in range(size):
+        origin = os.path.join(base, 'origins', f"repo{i:04d}.git")
+        repo = os.path.join(workspace, f"repo{i:04d}")
+        git('clone', '-q', '--bare', seed, origin)
+        git('clone', '-q', origin, repo)
+        state = STATES[i % len(STATES)]
+        if state == 'dirty':
+            with open(os.path.join(repo, 'README'), 'a') as f:
+                f.write("dirty\n")
+        elif state == 'ahead':
+            with open(os.path.join(repo, 'LOCAL'), 'w') as f:
+                f.write("ahead\n")
+            git('add', 'LOCAL', cwd=repo)
+            git('commit', '-q', '-m', 'local commit', cwd=repo)
+        elif state == 'behind':
+            git('reset', '-q', '--hard', 'HEAD~1', cwd=repo)
+        elif state == 'untracked':
+            os.makedirs(os.path.join(repo, 'build'))
+            for n in range(20):
+                open(os.path.join(repo, 'build', f"out{n}.o"), 'w').close()
+    return workspace
+
+def time_discovery(megagit_path, workspace, config_home):
+    """Time find_git_repos() in-process, first with an empty cache then warm."""
+    os.environ['XDG_CONFIG_HOME'] = config_home
+    spec = importlib.util.spec_from_file_location('megagit_bench_target', megagit_path)
+    megagit = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(megagit)
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        timings = {}
+        for label in ('cold', 'warm'):
+            megagit._discovered_repos = None
+            started = time.monotonic()
+            megagit.find_git_repos()
+            timings[label] = time.monotonic() - started
+        return timings
+    finally:
+        os.chdir(cwd)
+
+def run_action(megagit_path, workspace, config_home, action, jobs):
+    report_path = os.path.join(config_home, f"report-{action}.json")
+    env = {**os.environ, **GIT_ENV, 'XDG_CONFIG_HOME': config_home, 'USER': os.environ.get('USER') or 'bench'}
+    command = [sys.executable, megagit_path, f"--{action}", '--jobs', str(jobs),
+               '--report', 'json', '--report-file', report_path]
+    started = time.monotonic()
+    process = subprocess.run(command, cwd=workspace, env=env, capture_output=True, text=True)
+    wall_time = time.monotonic() - started
+    spawns = None
+    try:
+        with open(report_path) as f:
+            spawns = json.load(f)['summary']['spawns']
+    except (OSError, ValueError, KeyError):
+        pass
+    return {'wall_time': wall_time, 'spawns': spawns, 'exit_code': process.returncode}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark megagit against synthetic repository fleets.")
+    parser.add_argument("--sizes", default="10,50,100", help="Comma-separated fleet sizes.")
+    parser.add_argument("--jobs", default="1,4,16", help="Comma-separated --jobs settings to try.")
+    parser.add_argument("--actions", default=",".join(ACTIONS), help="Comma-separated megagit actions to time.")
+    parser.add_argument("--megagit", default=find_megagit(), help="Path to megagit.py (defaults to the copy next to this script).")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON instead of a table.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated fleets instead of deleting them.")
+    args = parser.parse_args()
+
+    if not args.megagit:
+        parser.error("could not find megagit.py; pass --megagit")
+    sizes = [int(size) for size in args.sizes.split(',')]
+    job_counts = [int(jobs) for jobs in args.jobs.split(',')]
+    actions = [action for action in args.actions.split(',') if action]
+
+    results = []
+    base_dir = tempfile.mkdtemp(prefix='megagit-bench-')
+    try:
+        for size in sizes:
+            for jobs in job_counts:
+                # Actions change the repos (WIP branches, pushes), so every
+                # combination starts from a freshly generated fleet.
+                base = os.path.join(base_dir, f"n{size}-j{jobs}")
+                os.makedirs(base)
+                started = time.monotonic()
+                workspace = make_fleet(base, size)
+                setup_time = time.monotonic() - started
+                config_home = os.path.join(base, 'config')
+                discovery = time_discovery(args.megagit, workspace, config_home)
+                results.append({'size': size, 'jobs': jobs, 'action': 'discover-cold', 'wall_time': discovery['cold'], 'spawns': 0, 'exit_code': 0})
+                results.append({'size': size, 'jobs': jobs, 'action': 'discover-warm', 'wall_time': discovery['warm'], 'spawns': 0, 'exit_code': 0})
+                for action in actions:
+                    results.append({'size': size, 'jobs': jobs, 'action': action,
+                                    **run_action(args.megagit, workspace, config_home, action, jobs)})
+                if not args.json:
+                    print(f"# fleet of {size} repos generated in {setup_time:.2f}s", file=sys.stderr)
+                if not args.keep:
+                    shutil.rmtree(base, ignore_errors=True)
+    finally:
+        if args.keep:
+            print(f"Fleets kept in {base_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return 0
+
+    print(f"{'repos':>6} {'jobs':>5} {'action':<14} {'wall (s)':>10} {'spawns':>7} {'exit':>5}")
+    for result in results:
+        spawns = '-' if result['spawns'] is None else result['spawns']
+        print(f"{result['size']:>6} {result['jobs']:>5} {result['action']:<14} {result['wall_time']:>10.3f} {spawns:>7} {result['exit_code']:>5}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
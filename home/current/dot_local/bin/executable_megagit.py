@@ -2,204 +2,1786 @@
 #!/usr/bin/env python3
 
 import os
+import io
+import sys
 import subprocess
 import json
+import shutil
+import hashlib
+import tempfile
 import argparse
+import asyncio
+import re
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import contextvars
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
 
+try:
+    import pygit2
+except ImportError:
+    pygit2 = None
+
 CONFIG_DIR = os.path.join(os.environ.get('XDG_CONFIG_HOME') or os.path.expanduser('~/.config'), 'bin', 'megagit')
 JSON_FILE = os.path.join(CONFIG_DIR, 'megagit.json')
+# Append-only record of which repos each --fetch/--pull/--wip/... run finished.
+JOURNAL_FILE = os.path.join(CONFIG_DIR, 'journal.ndjson')
+# Smoothed per-repo wall time of each action, used to order the next run.
+DURATIONS_FILE = os.path.join(CONFIG_DIR, 'durations.json')
+# Fingerprints of each remote's `git ls-remote` output as of the last fetch.
+REMOTE_REFS_FILE = os.path.join(CONFIG_DIR, 'remote-refs.json')
+# Repos whose git config --accelerate changed, with the previous values.
+ACCELERATED_FILE = os.path.join(CONFIG_DIR, 'accelerated.json')
 WIP_BASE_DIR = os.path.join("u", os.environ.get('USER'), "megagit") if os.environ.get('USER') else None
 VERBOSE = False
 DRY_RUN = False
+# Read-only queries (status, branches, remote URLs) go through pygit2 when
+# BACKEND is 'pygit2', or 'auto' and pygit2 is installed; 'cli' always forks git.
+BACKEND = 'auto'
+# 'priority' runs the longest-expected repos first (and, for --wip, recently
+# touched repos before everything else); 'alpha' keeps path order.
+ORDER = 'priority'
+RECENT_SECONDS = 3600
+# Set by --resume / --retry-failed; see Journal.
+RESUME = False
+RETRY_FAILED = False
+# check_unchecked_files() lists at most UNTRACKED_LIMIT paths per repo and
+# stops sizing a collapsed untracked directory after UNTRACKED_SCAN_LIMIT entries.
+UNTRACKED_LIMIT = 20
+UNTRACKED_SCAN_LIMIT = 10000
+# Compare `git ls-remote` with REMOTE_REFS_FILE and skip fetches when no
+# remote ref moved.
+SKIP_UNCHANGED = False
+# 'checkout' rebases every branch with an origin counterpart; 'refs' only
+# touches branches that are behind their upstream (see rebase_repo_refs).
+REBASE_MODE = 'checkout'
+# --maintain repacks repos with more loose objects or packs than these, and
+# writes a commit-graph where there is none. MAINTAIN_JOBS caps how many
+# repos are maintained at once.
+MAINTAIN_LOOSE_OBJECTS = 1000
+MAINTAIN_PACKS = 20
+MAINTAIN_JOBS = 2
+# --accelerate only touches repos with at least this many tracked files.
+ACCELERATE_FILES = 10000
+
+# Git subcommands that talk to a remote; these share the network slots while
+# everything else (status, rebase, checkout, ...) uses the local slots.
+NETWORK_COMMANDS = {'fetch', 'pull', 'push', 'ls-remote', 'clone'}
+NETWORK_JOBS = None
+LOCAL_JOBS = None
+# Network commands against one remote host (parsed from the origin URL) are
+# capped separately so parallel runs don't trip host rate limits.
+HOST_JOBS = 4
+# Upper bound on git processes alive at once, and the default per-command
+# timeout in seconds (None waits forever).
+MAX_GIT_PROCESSES = 64
+GIT_TIMEOUT = None
+
+# All git subprocesses are driven by one asyncio loop on a background thread;
+# its semaphores are created lazily from inside that loop.
+_engine_loop = None
+_engine_lock = threading.Lock()
+_engine_semaphores = None
+_host_semaphores = {}
+_repo_hosts = {}
+_known_urls = None
+_reaping = set()
+# ssh command with ControlMaster options, passed to network git commands as
+# core.sshCommand while multiplexing is on; repos with their own are skipped.
+_ssh_command = None
+_repo_ssh_commands = {}
+
+# The RepoRun for the repository the current worker is processing.
+_current_run = contextvars.ContextVar('megagit_current_run', default=None)
+# Set while megagit probes a repo for the report itself; those git commands
+# stay out of the report's commands, spawns and timings.
+_uncounted = contextvars.ContextVar('megagit_uncounted', default=False)
+_print_lock = threading.Lock()
+# Human-readable output goes here; it moves to stderr when a report is
+# written to stdout.
+HUMAN_OUT = sys.stdout
+REPORT = None
+JOURNAL = None
+_observed_durations = {}
+_spawn_count = 0
+_fetches_skipped = 0
+_maintenance_results = []
+_accelerated = {}
+_fsmonitor_supported = None
+# In --watch mode: repo path -> HEAD commit when it was last branched off as
+# dirty, so a repo that stays dirty isn't branched again on every change.
+_wip_handled = None
+_remote_refs = None
+
+# Directory names that never hold repositories worth managing; discovery
+# doesn't descend into them.
+PRUNE_DIRS = {
+    'node_modules', 'bower_components', '__pycache__', '.venv', 'venv', '.tox', '.nox',
+    '.mypy_cache', '.pytest_cache', '.ruff_cache', '.gradle', '.terraform', '.next', 'target',
+}
+# Repositories found under the current directory, computed once per process.
+_discovered_repos = None
+
+class RepoRun:
+    """Output buffer, failure flag and report record for one repository."""
+
+    def __init__(self, repo_path, action, buffered):
+        self.buffer = io.StringIO() if buffered else None
+        self.failed = False
+        self.started = time.monotonic()
+        self.ended = None
+        self.record = {"repo": repo_path, "action": action, "actions": [], "commands": [], "state": None}
+
+    def finish(self):
+        self.record["wall_time"] = round((self.ended or time.monotonic()) - self.started, 4)
+        self.record["exit_code"] = 1 if self.failed else 0
+        return self.buffer.getvalue() if self.buffer else ""
+
+def emit(message=""):
+    run = _current_run.get()
+    if run is not None and run.buffer is not None:
+        run.buffer.write(f"{message}\n")
+    else:
+        print(message, file=HUMAN_OUT)
 
 def verbose_print(message):
     if VERBOSE:
-        print(message)
+        emit(message)
+
+def mark_failed():
+    run = _current_run.get()
+    if run is not None:
+        run.failed = True
+
+def record_action(action):
+    run = _current_run.get()
+    if run is not None:
+        run.record["actions"].append(action)
+
+def record_state(state):
+    run = _current_run.get()
+    if run is not None:
+        run.record["state"] = {"branch": state.branch, "upstream": state.upstream, "clean": state.clean,
+                               "ahead": state.ahead, "behind": state.behind}
+
+# Matches the object-transfer progress lines git prints with --progress,
+# e.g. "Receiving objects: 100% (3/3), 1.20 MiB | 2.00 MiB/s, done."
+TRANSFER_RE = re.compile(r'(?:Receiving|Unpacking) objects: 100% \(\d+/\d+\), ([\d.]+) (bytes|KiB|MiB|GiB)')
+TRANSFER_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+def transferred_bytes(stderr):
+    total = None
+    for amount, unit in TRANSFER_RE.findall(stderr or ''):
+        total = (total or 0) + int(float(amount) * TRANSFER_UNITS[unit])
+    return total
+
+def record_command(command_list, process):
+    run = _current_run.get()
+    if run is not None and not _uncounted.get():
+        command = {"command": "git " + " ".join(command_list), "exit_code": process.returncode,
+                   "wall_time": round(getattr(process, 'wall_time', 0.0), 4)}
+        if command_list and command_list[0] in NETWORK_COMMANDS:
+            command["bytes"] = transferred_bytes(process.stderr)
+        run.record["commands"].append(command)
+
+class Report:
+    """Collects per-repo records for --report and writes them as JSON or NDJSON."""
+
+    def __init__(self, fmt, stream, top=10):
+        self.fmt = fmt
+        self.stream = stream
+        self.top = top
+        self.records = []
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, record):
+        with self.lock:
+            self.records.append(record)
+            if self.fmt == 'ndjson':
+                self.stream.write(json.dumps({"type": "repo", **record}) + "\n")
+                self.stream.flush()
+
+    def summary(self):
+        slowest = sorted(self.records, key=lambda r: r["wall_time"], reverse=True)[:self.top]
+        return {
+            "repos": len(self.records),
+            "failed": sum(1 for r in self.records if r["exit_code"]),
+            "spawns": _spawn_count,
+            "fetches_skipped": _fetches_skipped,
+            "wall_time": round(time.monotonic() - self.started, 4),
+            "git_time": round(sum(c["wall_time"] for r in self.records for c in r["commands"]), 4),
+            "slowest": [{"repo": r["repo"], "action": r["action"], "wall_time": r["wall_time"]} for r in slowest],
+        }
+
+    def close(self):
+        if self.fmt == 'ndjson':
+            self.stream.write(json.dumps({"type": "summary", **self.summary()}) + "\n")
+        else:
+            json.dump({"repos": self.records, "summary": self.summary()}, self.stream, indent=2)
+            self.stream.write("\n")
+        self.stream.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
 
-def run_git_command(repo_path, command_list, check=True):
+def engine_loop():
+    global _engine_loop
+    with _engine_lock:
+        if _engine_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='megagit-engine', daemon=True).start()
+            _engine_loop = loop
+    return _engine_loop
+
+def run_in_engine(coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, engine_loop()).result()
+
+def url_host(url):
+    """Host name a remote URL connects to; 'local' for paths and file:// URLs."""
+    if not url or url.startswith('file:') or url.startswith(('/', '.')):
+        return 'local'
+    match = re.match(r'^[a-z][a-z0-9+.-]*://(?:[^@/]*@)?(\[[^\]]+\]|[^:/]+)', url, re.I)
+    if match:
+        return match.group(1).lower()
+    match = re.match(r'^(?:[^@/]+@)?([^:/]{2,}):', url)  # scp-like user@host:path
+    return match.group(1).lower() if match else 'local'
+
+def read_remote_urls(repo_path):
+    """Remote name -> URL, read straight from .git/config without running git."""
+    urls = {}
+    remote = None
+    try:
+        with open(os.path.join(repo_path, '.git', 'config')) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    match = re.match(r'^\[remote\s+"([^"]+)"\]$', line)
+                    remote = match.group(1) if match else None
+                elif remote and remote not in urls and re.match(r'^url\s*=', line):
+                    urls[remote] = line.split('=', 1)[1].strip()
+    except OSError:
+        pass
+    return urls
+
+def has_ssh_command(repo_path):
+    """Whether .git/config sets core.sshCommand, read without running git."""
+    if repo_path not in _repo_ssh_commands:
+        found = False
+        section = None
+        try:
+            with open(os.path.join(repo_path, '.git', 'config')) as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith('['):
+                        section = line.strip('[]').strip().lower()
+                    elif section == 'core' and re.match(r'^sshcommand\s*=', line, re.I):
+                        found = True
+                        break
+        except OSError:
+            pass
+        _repo_ssh_commands[repo_path] = found
+    return _repo_ssh_commands[repo_path]
+
+def read_origin_url(repo_path):
+    return read_remote_urls(repo_path).get('origin', '')
+
+def repo_host(repo_path):
+    # Prefer the URL --init recorded in megagit.json; otherwise read .git/config
+    # directly so no git process is needed just to schedule one.
+    global _known_urls
+    if repo_path not in _repo_hosts:
+        if _known_urls is None:
+            _known_urls = {path: entry.get("url", "") for path, entry in load_config().get("repos", {}).items()}
+        _repo_hosts[repo_path] = url_host(_known_urls.get(repo_path) or read_origin_url(repo_path))
+    return _repo_hosts[repo_path]
+
+def _git_semaphores(repo_path, command_list):
+    global _engine_semaphores
+    if _engine_semaphores is None:
+        limits = {'process': MAX_GIT_PROCESSES, 'network': NETWORK_JOBS, 'local': LOCAL_JOBS}
+        _engine_semaphores = {kind: asyncio.Semaphore(limit) if limit else None for kind, limit in limits.items()}
+    semaphores = []
+    if command_list and command_list[0] in NETWORK_COMMANDS:
+        if HOST_JOBS:
+            host = repo_host(repo_path)
+            if host not in _host_semaphores:
+                _host_semaphores[host] = asyncio.Semaphore(HOST_JOBS)
+            semaphores.append(_host_semaphores[host])
+        semaphores.append(_engine_semaphores['network'])
+    else:
+        semaphores.append(_engine_semaphores['local'])
+    semaphores.append(_engine_semaphores['process'])
+    return [sem for sem in semaphores if sem is not None]
+
+async def _communicate(process, consume):
+    if consume is None:
+        return await process.communicate()
+
+    async def drain_stdout():
+        # consume may do blocking work (UntrackedSummary stats every entry),
+        # so it runs in a worker thread to keep the engine loop free for
+        # every other repo's git commands and timeouts.
+        while True:
+            chunk = await process.stdout.read(65536)
+            if not chunk:
+                break
+            await asyncio.to_thread(consume, chunk)
+
+    _, stderr = await asyncio.gather(drain_stdout(), process.stderr.read())
+    await process.wait()
+    return b'', stderr
+
+async def _spawn_git(repo_path, command_list, timeout, consume=None, counted=True):
+    """Run one git command under the engine's limits. With consume, stdout is
+    handed over chunk by chunk instead of being collected in memory."""
+    args = ['git', '-C', repo_path]
+    if _ssh_command and command_list and command_list[0] in NETWORK_COMMANDS and not has_ssh_command(repo_path):
+        args += ['-c', f'core.sshCommand={_ssh_command}']
+    args += command_list
+    async with AsyncExitStack() as stack:
+        for semaphore in _git_semaphores(repo_path, command_list):
+            await stack.enter_async_context(semaphore)
+        global _spawn_count
+        _spawn_count += counted
+        started = time.monotonic()
+        process = await asyncio.create_subprocess_exec(*args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(_communicate(process, consume), timeout)
+        except asyncio.TimeoutError:
+            # Reap in the background: helpers git spawned (ssh, ...) can hold
+            # the pipes open well after git itself is gone.
+            process.kill()
+            _reaping.add(asyncio.ensure_future(process.wait()))
+            _reaping.difference_update([task for task in _reaping if task.done()])
+            result = subprocess.CompletedProcess(args, 124, "", f"megagit: timed out after {timeout}s")
+        else:
+            result = subprocess.CompletedProcess(args, process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace'))
+    result.wall_time = time.monotonic() - started
+    return result
+
+def _log_git_result(repo_path, command_list, process, check):
+    record_command(command_list, process)
+    if check and process.returncode != 0:
+        mark_failed()
+        emit(f"Error in '{repo_path}': git {' '.join(command_list)}")
+        verbose_print(f"Stdout: {process.stdout}")
+        verbose_print(f"Stderr: {process.stderr}")
+    return process
+
+async def run_git_command_async(repo_path, command_list, check=True, timeout=None):
+    verbose_print(f"Executing in '{repo_path}': git {' '.join(command_list)}")
+    if DRY_RUN:
+        return subprocess.CompletedProcess(args=['git'] + command_list, returncode=0, stdout="Dry run", stderr="")
+    process = await _spawn_git(repo_path, command_list, timeout or GIT_TIMEOUT, counted=not _uncounted.get())
+    return _log_git_result(repo_path, command_list, process, check)
+
+def run_git_command(repo_path, command_list, check=True, timeout=None, consume=None):
     verbose_print(f"Executing in '{repo_path}': git {' '.join(command_list)}")
     if not DRY_RUN:
-        process = subprocess.run(['git', '-C', repo_path] + command_list, capture_output=True, text=True)
-        if check and process.returncode != 0:
-            print(f"Error in '{repo_path}': git {' '.join(command_list)}")
-            verbose_print(f"Stdout: {process.stdout}")
-            verbose_print(f"Stderr: {process.stderr}")
-        return process
+        process = run_in_engine(_spawn_git(repo_path, command_list, timeout or GIT_TIMEOUT, consume,
+                                           counted=not _uncounted.get()))
+        return _log_git_result(repo_path, command_list, process, check)
     else:
         return subprocess.CompletedProcess(args=['git'] + command_list, returncode=0, stdout="Dry run", stderr="")
 
-def find_git_repos():
+def start_ssh_multiplexing():
+    """Share one SSH connection per host across every git command in this run
+    by giving network commands a core.sshCommand with a ControlMaster socket
+    directory. Repos that set core.sshCommand themselves keep theirs.
+    Returns the directory, or None when the user already configured ssh."""
+    global _ssh_command
+    if os.name != 'posix' or os.environ.get('GIT_SSH_COMMAND') or os.environ.get('GIT_SSH'):
+        return None
+    # Only user/system-wide settings here; per-repo ones are checked per command.
+    if any(subprocess.run(['git', 'config', scope, '--get', 'core.sshCommand'], capture_output=True).returncode == 0
+           for scope in ('--system', '--global')):
+        return None
+    # Keep the path short: unix socket paths are limited to ~100 bytes.
+    control_dir = tempfile.mkdtemp(prefix='mg-', dir='/tmp')
+    _ssh_command = f"ssh -o ControlMaster=auto -o ControlPath={control_dir}/%C -o ControlPersist=60"
+    return control_dir
+
+def stop_ssh_multiplexing(control_dir):
+    global _ssh_command
+    if not control_dir:
+        return
+    for name in os.listdir(control_dir):
+        subprocess.run(['ssh', '-o', f'ControlPath={os.path.join(control_dir, name)}', '-O', 'exit', 'megagit'],
+                       capture_output=True, timeout=10)
+    shutil.rmtree(control_dir, ignore_errors=True)
+    _ssh_command = None
+
+def load_config():
+    try:
+        with open(JSON_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json_atomic(path, data):
+    # Write to a temp file and rename it into place so a concurrent run never
+    # reads a half-written file.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.megagit-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def save_config(data):
+    write_json_atomic(JSON_FILE, data)
+
+def scan_tree(root, cached_dirs):
+    """Walk root looking for repositories, reusing cached_dirs where possible.
+
+    cached_dirs maps a path relative to root to [mtime_ns, is_repo, subdirs].
+    A directory whose mtime is unchanged still has the same entries, so its
+    cached subdirectory list is reused instead of listing it again.
+    Returns (repos, dirs) where dirs is the refreshed cache.
+    """
     repos = []
-    for root, dirs, files in os.walk('.'):
-        if '.git' in dirs:
-            repos.append(os.path.abspath(root))
-            dirs.remove('.git')
-    return sorted(list(set(repos)))
+    dirs = {}
+    pending = ['.']
+    while pending:
+        rel_path = pending.pop()
+        path = os.path.join(root, rel_path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            continue
+        cached = cached_dirs.get(rel_path)
+        if cached and cached[0] == mtime:
+            is_repo, subdirs = cached[1], cached[2]
+        else:
+            try:
+                with os.scandir(path) as entries:
+                    names = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
+            except OSError:
+                continue
+            is_repo = '.git' in names
+            subdirs = sorted(name for name in names if name != '.git' and name not in PRUNE_DIRS)
+        dirs[rel_path] = [mtime, is_repo, subdirs]
+        if is_repo:
+            repos.append(os.path.normpath(path))
+        pending.extend(os.path.join(rel_path, name) for name in subdirs)
+    return sorted(repos), dirs
+
+def find_git_repos(rescan=False):
+    global _discovered_repos
+    if _discovered_repos is not None and not rescan:
+        return _discovered_repos
+
+    root = os.path.abspath('.')
+    config = load_config()
+    discovery = config.get('discovery', {})
+    cached_dirs = {} if rescan else discovery.get(root, {}).get('dirs', {})
+    repos, dirs = scan_tree(root, cached_dirs)
+    if dirs != cached_dirs:
+        discovery[root] = {'dirs': dirs}
+        config['discovery'] = discovery
+        try:
+            save_config(config)
+        except OSError as e:
+            verbose_print(f"Could not save discovery cache to {JSON_FILE}: {e}")
+    _discovered_repos = repos
+    return repos
+
+@dataclass
+class BranchState:
+    name: str
+    oid: str
+    upstream: str = ''
+    ahead: int = 0
+    behind: int = 0
+    gone: bool = False
+    worktree: str = ''
+
+@dataclass
+class RepoState:
+    """Everything the handlers need to know about a repository, gathered from
+    one `git status` and one `git for-each-ref` call."""
+    path: str
+    branch: str = None
+    oid: str = None
+    upstream: str = None
+    ahead: int = 0
+    behind: int = 0
+    staged: int = 0
+    unstaged: int = 0
+    unmerged: int = 0
+    branches: dict = field(default_factory=dict)
+    remote_refs: dict = field(default_factory=dict)
+    remote_urls: dict = field(default_factory=dict)
+
+    @property
+    def clean(self):
+        return not (self.staged or self.unstaged or self.unmerged)
+
+    @property
+    def origin_url(self):
+        return self.remote_urls.get('origin', '')
+
+REF_FORMAT = '%(refname)%00%(objectname)%00%(upstream:short)%00%(upstream:track,nobracket)%00%(worktreepath)'
+
+def parse_status(state, output):
+    records = iter(output.split('\0'))
+    for record in records:
+        if record.startswith('# branch.oid '):
+            oid = record.split(' ', 2)[2]
+            state.oid = None if oid == '(initial)' else oid
+        elif record.startswith('# branch.head '):
+            head = record.split(' ', 2)[2]
+            state.branch = None if head == '(detached)' else head
+        elif record.startswith('# branch.upstream '):
+            state.upstream = record.split(' ', 2)[2]
+        elif record.startswith('# branch.ab '):
+            ahead, behind = record.split(' ')[2:4]
+            state.ahead, state.behind = int(ahead), -int(behind)
+        elif record[:2] in ('1 ', '2 '):
+            xy = record[2:4]
+            state.staged += xy[0] != '.'
+            state.unstaged += xy[1] != '.'
+            if record[0] == '2':
+                next(records, None)  # rename/copy entries carry the original path as a second record
+        elif record.startswith('u '):
+            state.unmerged += 1
+
+def parse_track(track):
+    ahead = behind = 0
+    for part in track.split(', '):
+        if part.startswith('ahead '):
+            ahead = int(part[6:])
+        elif part.startswith('behind '):
+            behind = int(part[7:])
+    return ahead, behind
+
+def parse_refs(state, output):
+    for line in output.splitlines():
+        fields = line.split('\0')
+        if len(fields) != 5:
+            continue
+        refname, oid, upstream, track, worktree = fields
+        if refname.startswith('refs/heads/'):
+            name = refname[len('refs/heads/'):]
+            ahead, behind = parse_track(track)
+            state.branches[name] = BranchState(name, oid, upstream, ahead, behind, track == 'gone', worktree)
+        elif refname.startswith('refs/remotes/'):
+            state.remote_refs[refname[len('refs/remotes/'):]] = oid
+
+def use_library():
+    return pygit2 is not None and BACKEND in ('auto', 'pygit2')
+
+def _status_flags(*names):
+    # pygit2 >= 1.15 moved the GIT_STATUS_* constants into enums.FileStatus.
+    file_status = getattr(getattr(pygit2, 'enums', None), 'FileStatus', None)
+    flags = 0
+    for name in names:
+        flags |= int(getattr(file_status, name)) if file_status else getattr(pygit2, f'GIT_STATUS_{name}')
+    return flags
+
+def _short_ref(refname):
+    for prefix in ('refs/heads/', 'refs/remotes/'):
+        if refname.startswith(prefix):
+            return refname[len(prefix):]
+    return refname
+
+def probe_repo_library(repo_path, remotes=False):
+    """probe_repo() without forking git: the same RepoState read with pygit2."""
+    repo = pygit2.Repository(repo_path)
+    state = RepoState(repo_path)
+    if not repo.head_is_unborn:
+        state.oid = str(repo.head.target)
+        state.branch = None if repo.head_is_detached else repo.head.shorthand
+
+    staged = _status_flags('INDEX_NEW', 'INDEX_MODIFIED', 'INDEX_DELETED', 'INDEX_RENAMED', 'INDEX_TYPECHANGE')
+    unstaged = _status_flags('WT_MODIFIED', 'WT_DELETED', 'WT_TYPECHANGE', 'WT_RENAMED')
+    conflicted = _status_flags('CONFLICTED')
+    try:
+        status = repo.status(untracked_files='no')
+    except TypeError:  # pygit2 < 1.14 has no untracked_files argument
+        status = repo.status()
+    for flags in status.values():
+        if flags & conflicted:
+            state.unmerged += 1
+            continue
+        state.staged += bool(flags & staged)
+        state.unstaged += bool(flags & unstaged)
+
+    for name in repo.branches.remote:
+        state.remote_refs[name] = str(repo.branches.remote[name].resolve().target)
+    for name in repo.branches.local:
+        branch = repo.branches.local[name]
+        branch_state = BranchState(name, str(branch.target))
+        try:
+            upstream_name = branch.upstream_name
+        except (KeyError, pygit2.GitError):
+            upstream_name = None
+        if upstream_name:
+            upstream = branch.upstream
+            branch_state.upstream = _short_ref(upstream_name)
+            if upstream is None:
+                branch_state.gone = True
+            else:
+                branch_state.ahead, branch_state.behind = repo.ahead_behind(branch.target, upstream.target)
+        if name == state.branch:
+            branch_state.worktree = repo_path
+        elif branch.is_checked_out():
+            branch_state.worktree = '(another worktree)'
+        state.branches[name] = branch_state
+
+    current = state.branches.get(state.branch)
+    if current and current.upstream and not current.gone:
+        state.upstream, state.ahead, state.behind = current.upstream, current.ahead, current.behind
+    if remotes:
+        state.remote_urls = {remote.name: remote.url for remote in repo.remotes}
+    return state
+
+def probe_repo(repo_path, remotes=False):
+    if use_library():
+        try:
+            state = probe_repo_library(repo_path, remotes)
+            record_state(state)
+            return state
+        except Exception as e:
+            verbose_print(f"  pygit2 could not read '{repo_path}' ({e}); using git instead.")
+    state = RepoState(repo_path)
+    status = run_git_command(repo_path, ['status', '--porcelain=v2', '--branch', '-z', '--untracked-files=no'], check=False)
+    if status.returncode == 0:
+        parse_status(state, status.stdout)
+    refs = run_git_command(repo_path, ['for-each-ref', f'--format={REF_FORMAT}', 'refs/heads', 'refs/remotes'], check=False)
+    if refs.returncode == 0:
+        parse_refs(state, refs.stdout)
+    if remotes:
+        state.remote_urls = get_remote_urls(repo_path)
+    record_state(state)
+    return state
+
+def get_remote_urls(repo_path):
+    if use_library():
+        try:
+            return {remote.name: remote.url for remote in pygit2.Repository(repo_path).remotes}
+        except Exception:
+            pass
+    process = run_git_command(repo_path, ['config', '--get-regexp', r'^remote\..*\.url$'], check=False)
+    urls = {}
+    for line in process.stdout.splitlines() if process.returncode == 0 else []:
+        key, _, url = line.partition(' ')
+        urls[key[len('remote.'):-len('.url')]] = url
+    return urls
+
+def is_http_url(url):
+    return url.startswith('http')
+
+def is_ssh_url(url):
+    return url.startswith('git@')
 
 def is_http_remote(repo_path):
-    process = run_git_command(repo_path, ['remote', 'get-url', 'origin'], check=False)
-    return process and process.returncode == 0 and process.stdout.strip().startswith('http')
+    return is_http_url(get_remote_urls(repo_path).get('origin', ''))
 
 def is_ssh_remote(repo_path):
-    process = run_git_command(repo_path, ['remote', 'get-url', 'origin'], check=False)
-    return process and process.returncode == 0 and process.stdout.strip().startswith('git@')
+    return is_ssh_url(get_remote_urls(repo_path).get('origin', ''))
 
 def is_repo_clean(repo_path):
-    diff_process = run_git_command(repo_path, ['diff', '--quiet'], check=False)
-    staged_process = run_git_command(repo_path, ['diff', '--staged', '--quiet'], check=False)
-    return diff_process.returncode == 0 and staged_process.returncode == 0
+    return probe_repo(repo_path).clean
 
-def create_wip_branch(repo_path):
-    original_branch = run_git_command(repo_path, ['symbolic-ref', '--short', 'HEAD'], check=False).stdout.strip()
+def create_wip_branch(repo_path, state=None):
+    if state:
+        original_branch = state.branch or ''
+    else:
+        original_branch = run_git_command(repo_path, ['symbolic-ref', '--short', 'HEAD'], check=False).stdout.strip()
     timestamp = datetime.now().strftime("%Y%m%d%H%M")
     wip_branch_name = os.path.join("wip", os.environ.get('USER'), f"{timestamp}-{original_branch}") if os.environ.get('USER') else f"wip/unknown/{timestamp}-{original_branch}"
     if WIP_BASE_DIR:
         full_wip_branch_name = os.path.join(WIP_BASE_DIR, f"{timestamp}-{original_branch}")
         verbose_print(f"  Creating WIP branch: {full_wip_branch_name}")
+        record_action(f"wip-branch:{full_wip_branch_name}")
         run_git_command(repo_path, ['checkout', '-b', full_wip_branch_name])
     else:
-        print("Warning: USER environment variable not set, using a simpler WIP branch name.")
+        emit("Warning: USER environment variable not set, using a simpler WIP branch name.")
         verbose_print(f"  Creating WIP branch: {wip_branch_name}")
+        record_action(f"wip-branch:{wip_branch_name}")
         run_git_command(repo_path, ['checkout', '-b', wip_branch_name])
 
-def handle_wip_dirty(repo_path):
-    print(f"  Repository '{repo_path}' is dirty.")
+def is_wip_branch(branch):
+    if not branch:
+        return False
+    prefix = WIP_BASE_DIR or "wip"
+    return branch.startswith(prefix + "/")
+
+def handle_wip_dirty(repo_path, state):
+    emit(f"  Repository '{repo_path}' is dirty.")
     if not DRY_RUN:
-        create_wip_branch(repo_path)
+        create_wip_branch(repo_path, state)
     else:
         verbose_print(f"  Dry-run: Would create a WIP branch for dirty repo '{repo_path}'.")
 
-def handle_wip_clean(repo_path):
-    print(f"  Repository '{repo_path}' is clean.")
-    rebase_repo(repo_path)
+def handle_wip_clean(repo_path, state):
+    emit(f"  Repository '{repo_path}' is clean.")
+    rebase_repo(repo_path, state)
     if not DRY_RUN:
-        current_branch = run_git_command(repo_path, ['symbolic-ref', '--short', 'HEAD'], check=False).stdout.strip()
-        remote_branch_process = run_git_command(repo_path, ['rev-parse', '--abbrev-ref', '--symbolic-full-name', "@{u}"], check=False)
-        remote_branch = remote_branch_process.stdout.strip() if remote_branch_process.returncode == 0 else None
+        current_branch = state.branch or ''
+        remote_branch = state.upstream
 
         if remote_branch:
             verbose_print(f"  Pushing '{current_branch}' to '{remote_branch}'.")
+            record_action(f"push:{current_branch}")
             push_process = run_git_command(repo_path, ['push', 'origin', current_branch], check=False)
             if push_process.returncode != 0:
-                print(f"  Warning: Problems encountered during push in '{repo_path}'. Creating WIP branch.")
-                create_wip_branch(repo_path)
+                emit(f"  Warning: Problems encountered during push in '{repo_path}'. Creating WIP branch.")
+                create_wip_branch(repo_path, state)
         else:
             verbose_print(f"  No remote tracking branch found for '{current_branch}' in '{repo_path}'. Skipping push.")
     else:
         verbose_print(f"  Dry-run: Would rebase and potentially push clean repo '{repo_path}'.")
 
-def rebase_repo(repo_path):
+def rebase_repo(repo_path, state=None):
+    state = state or probe_repo(repo_path)
+    if REBASE_MODE == 'refs':
+        return rebase_repo_refs(repo_path, state)
     verbose_print(f"  Rebasing branches with remote equivalents in '{repo_path}'.")
-    branches_process = run_git_command(repo_path, ['for-each-ref', '--format=%(refname:short)', 'refs/heads'], check=False)
-    if branches_process.returncode == 0:
-        local_branches = branches_process.stdout.strip().splitlines()
-        current_branch = run_git_command(repo_path, ['symbolic-ref', '--short', 'HEAD'], check=False).stdout.strip()
-
-        for branch in local_branches:
-            remote_branch_process = run_git_command(repo_path, ['rev-parse', '--abbrev-ref', '--symbolic-full-name', f"origin/{branch}"], check=False)
-            remote_branch = remote_branch_process.stdout.strip() if remote_branch_process.returncode == 0 else None
-
-            if remote_branch:
-                verbose_print(f"    Rebasing '{branch}' onto '{remote_branch}'.")
-                if not DRY_RUN:
-                    run_git_command(repo_path, ['checkout', branch], check=True)
-                    rebase_process = run_git_command(repo_path, ['rebase', f"origin/{branch}"], check=False)
-                    if rebase_process.returncode != 0:
-                        print(f"    Warning: Conflicts or errors during rebase of '{branch}' in '{repo_path}'. You may need to resolve them manually.")
-                else:
-                    verbose_print(f"    Dry-run: Would rebase '{branch}' onto '{remote_branch}'.")
+    current_branch = state.branch
+
+    for branch in state.branches:
+        remote_branch = f"origin/{branch}" if f"origin/{branch}" in state.remote_refs else None
 
-        if not DRY_RUN and current_branch:
-            run_git_command(repo_path, ['checkout', current_branch], check=False)
+        if remote_branch:
+            verbose_print(f"    Rebasing '{branch}' onto '{remote_branch}'.")
+            if not DRY_RUN:
+                record_action(f"rebase:{branch}")
+                run_git_command(repo_path, ['checkout', branch], check=True)
+                rebase_process = run_git_command(repo_path, ['rebase', f"origin/{branch}"], check=False)
+                if rebase_process.returncode != 0:
+                    emit(f"    Warning: Conflicts or errors during rebase of '{branch}' in '{repo_path}'. You may need to resolve them manually.")
+            else:
+                verbose_print(f"    Dry-run: Would rebase '{branch}' onto '{remote_branch}'.")
+
+    if not DRY_RUN and current_branch:
+        run_git_command(repo_path, ['checkout', current_branch], check=False)
+
+def rebase_repo_refs(repo_path, state):
+    """Bring local branches up to their upstreams using the ahead/behind
+    counts already in state. Up-to-date branches are left alone, branches
+    that are only behind are fast-forwarded (with update-ref when they are
+    not checked out), and only diverged branches are checked out and rebased."""
+    verbose_print(f"  Updating branches from their upstreams in '{repo_path}'.")
+    switched = False
+    for branch in state.branches.values():
+        if not branch.upstream or branch.gone:
+            continue
+        if branch.behind == 0:
+            verbose_print(f"    '{branch.name}' is up to date with '{branch.upstream}'.")
+            continue
+        upstream_oid = state.remote_refs.get(branch.upstream) or getattr(state.branches.get(branch.upstream), 'oid', None)
+        if branch.ahead == 0 and branch.name == state.branch:
+            verbose_print(f"    Fast-forwarding checked-out '{branch.name}' to '{branch.upstream}'.")
+            if not DRY_RUN:
+                record_action(f"fast-forward:{branch.name}")
+                run_git_command(repo_path, ['merge', '--ff-only', '--quiet', branch.upstream])
+        elif branch.worktree and os.path.normpath(branch.worktree) != os.path.normpath(repo_path):
+            emit(f"    Skipping '{branch.name}': it is checked out in '{branch.worktree}'.")
+        elif branch.ahead == 0 and upstream_oid:
+            verbose_print(f"    Fast-forwarding '{branch.name}' to '{branch.upstream}' ({branch.behind} behind).")
+            if not DRY_RUN:
+                record_action(f"fast-forward:{branch.name}")
+                run_git_command(repo_path, ['update-ref', '-m', f"megagit: fast-forward to {branch.upstream}",
+                                            f"refs/heads/{branch.name}", upstream_oid, branch.oid])
+        else:
+            verbose_print(f"    Rebasing '{branch.name}' onto '{branch.upstream}' ({branch.ahead} ahead, {branch.behind} behind).")
+            if not DRY_RUN:
+                record_action(f"rebase:{branch.name}")
+                switched = switched or branch.name != state.branch
+                run_git_command(repo_path, ['checkout', branch.name], check=True)
+                rebase_process = run_git_command(repo_path, ['rebase', branch.upstream], check=False)
+                if rebase_process.returncode != 0:
+                    emit(f"    Warning: Conflicts or errors during rebase of '{branch.name}' in '{repo_path}'. You may need to resolve them manually.")
+
+    if switched and state.branch:
+        run_git_command(repo_path, ['checkout', state.branch], check=False)
+
+def transfer_flags():
+    # --progress makes git report transfer sizes even though stderr is a pipe.
+    return (['-v'] if VERBOSE else []) + (['--progress'] if REPORT else [])
 
 def fetch_repo(repo_path):
     verbose_print(f"  Fetching in '{repo_path}'.")
-    run_git_command(repo_path, ['fetch', '--all'] + (['-v'] if VERBOSE else []))
+    record_action("fetch")
+    run_git_command(repo_path, ['fetch', '--all'] + transfer_flags())
+
+async def remote_fingerprints(repo_path):
+    """Hash of each remote's `git ls-remote` output, or None if any failed."""
+    remotes = sorted(read_remote_urls(repo_path))
+    results = await asyncio.gather(*(run_git_command_async(repo_path, ['ls-remote', remote], check=False)
+                                     for remote in remotes))
+    if not remotes or any(result.returncode != 0 for result in results):
+        return None
+    return {remote: hashlib.sha1(result.stdout.encode()).hexdigest() for remote, result in zip(remotes, results)}
+
+async def fetch_repo_async(repo_path):
+    global _fetches_skipped
+    fingerprints = None
+    if SKIP_UNCHANGED and not DRY_RUN:
+        fingerprints = await remote_fingerprints(repo_path)
+        if fingerprints and _remote_refs.get(repo_path) == fingerprints:
+            verbose_print(f"  No remote refs moved for '{repo_path}'. Skipping fetch.")
+            record_action("fetch-skipped")
+            _fetches_skipped += 1
+            return
+    verbose_print(f"  Fetching in '{repo_path}'.")
+    record_action("fetch")
+    process = await run_git_command_async(repo_path, ['fetch', '--all'] + transfer_flags())
+    if fingerprints and process.returncode == 0:
+        _remote_refs[repo_path] = fingerprints
+
+def fetch_repos(jobs=1):
+    global _remote_refs
+    if SKIP_UNCHANGED:
+        try:
+            with open(REMOTE_REFS_FILE) as f:
+                _remote_refs = json.load(f)
+        except (OSError, ValueError):
+            _remote_refs = {}
+    failures = run_journaled('fetch', fetch_repo_async, jobs, runner=run_repos_async)
+    if SKIP_UNCHANGED:
+        write_json_atomic(REMOTE_REFS_FILE, _remote_refs)
+        emit(f"Skipped {_fetches_skipped} fetch{'' if _fetches_skipped == 1 else 'es'} with no remote changes.")
+    return failures
 
 def pull_repo(repo_path):
-    if is_repo_clean(repo_path):
-        print(f"  Pulling all remote branches in clean repo '{repo_path}'.")
-        run_git_command(repo_path, ['pull', '--all'] + (['-v'] if VERBOSE else []))
+    if probe_repo(repo_path).clean:
+        emit(f"  Pulling all remote branches in clean repo '{repo_path}'.")
+        record_action("pull")
+        run_git_command(repo_path, ['pull', '--all'] + transfer_flags())
+    else:
+        emit(f"  Warning: Repository '{repo_path}' is not clean. Skipping pull.")
+        record_action("skip-dirty")
+
+def count_objects(repo_path):
+    """`git count-objects -v` as a dict of ints (sizes are in KiB)."""
+    process = run_git_command(repo_path, ['count-objects', '-v'], check=False)
+    counts = {}
+    for line in process.stdout.splitlines() if process.returncode == 0 else []:
+        key, _, value = line.partition(':')
+        if value.strip().isdigit():
+            counts[key.strip()] = int(value)
+    return counts
+
+def object_store_size(counts):
+    return 1024 * (counts.get('size', 0) + counts.get('size-pack', 0) + counts.get('size-garbage', 0))
+
+def has_commit_graph(repo_path):
+    info = os.path.join(repo_path, '.git', 'objects', 'info')
+    return os.path.exists(os.path.join(info, 'commit-graph')) or os.path.isdir(os.path.join(info, 'commit-graphs'))
+
+def probe_time(repo_path, runs=3):
+    # Best of a few runs, so the first (cold cache) probe doesn't skew the comparison.
+    timings = []
+    for _ in range(runs):
+        started = time.monotonic()
+        probe_repo(repo_path, remotes=True)
+        timings.append(time.monotonic() - started)
+    return min(timings)
+
+def maintenance_tasks(repo_path, counts):
+    """The maintenance commands a repository needs, judged against the
+    MAINTAIN_* thresholds."""
+    if counts.get('count', 0) > MAINTAIN_LOOSE_OBJECTS or counts.get('packs', 0) > MAINTAIN_PACKS:
+        # gc also writes the commit-graph (gc.writeCommitGraph defaults to true).
+        return [['maintenance', 'run', '--task=gc', '--quiet']]
+    if not has_commit_graph(repo_path):
+        return [['commit-graph', 'write', '--reachable', '--changed-paths']]
+    return []
+
+def maintain_repo(repo_path):
+    before = count_objects(repo_path)
+    tasks = maintenance_tasks(repo_path, before)
+    if not tasks:
+        verbose_print(f"  '{repo_path}' needs no maintenance ({before.get('count', 0)} loose objects, {before.get('packs', 0)} packs).")
+        record_action("skip-maintained")
+        return
+    emit(f"  Maintaining '{repo_path}' ({before.get('count', 0)} loose objects, {before.get('packs', 0)} packs).")
+    if DRY_RUN:
+        for task in tasks:
+            emit(f"    Dry-run: Would run git {' '.join(task)}")
+        return
+    probe_before = probe_time(repo_path)
+    for task in tasks:
+        record_action(task[0])
+        run_git_command(repo_path, task)
+    after = count_objects(repo_path)
+    probe_after = probe_time(repo_path)
+    result = {"disk_before": object_store_size(before), "disk_after": object_store_size(after),
+              "probe_before": round(probe_before, 4), "probe_after": round(probe_after, 4)}
+    _maintenance_results.append(result)
+    run = _current_run.get()
+    if run is not None:
+        run.record["maintenance"] = result
+    emit(f"    Objects: {format_size(result['disk_before'])} -> {format_size(result['disk_after'])}, "
+         f"probe: {probe_before * 1000:.1f} ms -> {probe_after * 1000:.1f} ms")
+
+def maintain_repos(jobs=1):
+    """Pack and index the repositories whose object stores have run past the
+    MAINTAIN_* thresholds. gc is CPU and I/O heavy, so at most MAINTAIN_JOBS
+    repositories are maintained at once whatever --jobs says."""
+    failures = run_journaled('maintain', maintain_repo, max(1, min(jobs, MAINTAIN_JOBS)))
+    if _maintenance_results:
+        disk_before = sum(r["disk_before"] for r in _maintenance_results)
+        disk_after = sum(r["disk_after"] for r in _maintenance_results)
+        probe_before = sum(r["probe_before"] for r in _maintenance_results)
+        probe_after = sum(r["probe_after"] for r in _maintenance_results)
+        emit(f"Maintained {len(_maintenance_results)} repositor{'y' if len(_maintenance_results) == 1 else 'ies'}: "
+             f"objects {format_size(disk_before)} -> {format_size(disk_after)} "
+             f"(saved {format_size(max(0, disk_before - disk_after))}), "
+             f"total probe time {probe_before * 1000:.1f} ms -> {probe_after * 1000:.1f} ms.")
+    else:
+        emit("No repositories needed maintenance.")
+    return failures
+
+def index_entries(repo_path):
+    """Number of entries in .git/index, read from its header without running git."""
+    try:
+        with open(os.path.join(repo_path, '.git', 'index'), 'rb') as f:
+            signature, _, entries = struct.unpack('>4sII', f.read(12))
+    except (OSError, struct.error):
+        return 0
+    return entries if signature == b'DIRC' else 0
+
+def builtin_fsmonitor_supported():
+    # The built-in fsmonitor daemon only exists on macOS and Windows builds.
+    global _fsmonitor_supported
+    if _fsmonitor_supported is None:
+        process = subprocess.run(['git', 'version', '--build-options'], capture_output=True, text=True)
+        _fsmonitor_supported = 'fsmonitor--daemon' in process.stdout
+    return _fsmonitor_supported
+
+def acceleration_settings():
+    settings = {'core.untrackedcache': 'true', 'feature.manyfiles': 'true'}
+    if builtin_fsmonitor_supported():
+        settings['core.fsmonitor'] = 'true'
+    return settings
+
+def status_time(repo_path, runs=3):
+    # Includes untracked files: that scan is what the untracked cache and
+    # fsmonitor avoid. Best of a few runs so the first one can fill the caches.
+    timings = []
+    for _ in range(runs):
+        started = time.monotonic()
+        run_git_command(repo_path, ['status', '--porcelain=v2', '-z'], check=False)
+        timings.append(time.monotonic() - started)
+    return min(timings)
+
+def accelerate_repo(repo_path):
+    entries = index_entries(repo_path)
+    if entries < ACCELERATE_FILES:
+        verbose_print(f"  '{repo_path}' has {entries} files; not accelerating.")
+        record_action("skip-small")
+        return
+    process = run_git_command(repo_path, ['config', '--local', '--get-regexp', r'^(core\.(untrackedcache|fsmonitor)|feature\.manyfiles)$'],
+                              check=False)
+    current = {}
+    for line in process.stdout.splitlines() if process.returncode == 0 else []:
+        key, _, value = line.partition(' ')
+        current[key.lower()] = value
+    changes = {key: value for key, value in acceleration_settings().items() if current.get(key) != value}
+    if not changes:
+        verbose_print(f"  '{repo_path}' is already accelerated.")
+        return
+    emit(f"  Accelerating '{repo_path}' ({entries} files): {', '.join(f'{key}={value}' for key, value in changes.items())}")
+    if DRY_RUN:
+        return
+    before = status_time(repo_path)
+    for key, value in changes.items():
+        record_action(f"config {key}")
+        run_git_command(repo_path, ['config', '--local', key, value])
+    after = status_time(repo_path)
+    emit(f"    status: {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+    # Previous values are kept so the change can be undone by hand.
+    _accelerated[repo_path] = {"files": entries, "previous": {key: current.get(key) for key in changes},
+                               "settings": changes, "status_before": round(before, 4), "status_after": round(after, 4),
+                               "time": time.time()}
+    run = _current_run.get()
+    if run is not None:
+        run.record["acceleration"] = _accelerated[repo_path]
+
+def accelerate_repos(jobs=1):
+    """Turn on the untracked cache, feature.manyFiles and (where git has it)
+    the built-in fsmonitor in repositories with at least ACCELERATE_FILES
+    tracked files, recording every change in ACCELERATED_FILE."""
+    if not builtin_fsmonitor_supported():
+        verbose_print("This git has no built-in fsmonitor daemon; only enabling the untracked cache and feature.manyFiles.")
+    _accelerated.clear()
+    try:
+        failures = run_journaled('accelerate', accelerate_repo, jobs)
+    finally:
+        if _accelerated:
+            try:
+                with open(ACCELERATED_FILE) as f:
+                    recorded = json.load(f)
+            except (OSError, ValueError):
+                recorded = {}
+            recorded.update(_accelerated)
+            write_json_atomic(ACCELERATED_FILE, dict(sorted(recorded.items())))
+    if _accelerated:
+        before = sum(entry["status_before"] for entry in _accelerated.values())
+        after = sum(entry["status_after"] for entry in _accelerated.values())
+        emit(f"Accelerated {len(_accelerated)} repositor{'y' if len(_accelerated) == 1 else 'ies'}: "
+             f"total status time {before * 1000:.1f} ms -> {after * 1000:.1f} ms. Changes recorded in {ACCELERATED_FILE}.")
     else:
-        print(f"  Warning: Repository '{repo_path}' is not clean. Skipping pull.")
+        emit("No repositories needed accelerating.")
+    return failures
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def tree_size(path, limit):
+    """Total size of the files under path, giving up after `limit` entries.
+    Returns (size, complete)."""
+    size = seen = 0
+    pending = [path]
+    while pending:
+        try:
+            with os.scandir(pending.pop()) as entries:
+                for entry in entries:
+                    seen += 1
+                    if seen > limit:
+                        return size, False
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            continue
+    return size, True
+
+class UntrackedSummary:
+    """Aggregates a streamed `ls-files --others -z --directory` listing by
+    top-level directory, keeping only the first `limit` paths."""
+
+    def __init__(self, repo_path, limit):
+        self.repo_path = repo_path
+        self.limit = limit
+        self.listed = []
+        self.total = 0
+        self.groups = {}
+        self.complete = True
+        self._partial = b''
+
+    def feed(self, chunk):
+        records = (self._partial + chunk).split(b'\0')
+        self._partial = records.pop()
+        for record in records:
+            if record:
+                self.add(record.decode(errors='replace'))
+
+    def add(self, path):
+        self.total += 1
+        if len(self.listed) < self.limit:
+            self.listed.append(path)
+        full_path = os.path.join(self.repo_path, path)
+        if path.endswith('/'):
+            # --directory collapsed a whole untracked directory into this entry.
+            size, complete = tree_size(full_path, UNTRACKED_SCAN_LIMIT)
+            self.complete = self.complete and complete
+        else:
+            try:
+                size = os.lstat(full_path).st_size
+            except OSError:
+                size = 0
+        top = path.split('/', 1)[0] + '/' if '/' in path else '.'
+        group = self.groups.setdefault(top, [0, 0])
+        group[0] += 1
+        group[1] += size
 
 def check_unchecked_files(repo_path):
-    process = run_git_command(repo_path, ['ls-files', '--others', '--exclude-standard'], check=False)
-    unchecked_files = [f for f in process.stdout.strip().splitlines() if f]
-    if unchecked_files:
-        print(f"  Unchecked files in '{repo_path}':")
-        for f in unchecked_files:
-            print(f"    {f}")
-    elif VERBOSE:
+    summary = UntrackedSummary(repo_path, UNTRACKED_LIMIT)
+    run_git_command(repo_path, ['ls-files', '--others', '--exclude-standard', '--directory', '--no-empty-directory', '-z'],
+                    check=False, consume=summary.feed)
+    if not summary.total:
         verbose_print(f"  No unchecked files in '{repo_path}'.")
+        return
+    total_size = sum(size for _, size in summary.groups.values())
+    approx = '' if summary.complete else '≥ '
+    emit(f"  Unchecked files in '{repo_path}': {summary.total} entries, {approx}{format_size(total_size)}")
+    for path in summary.listed:
+        emit(f"    {path}")
+    if summary.total > len(summary.listed):
+        emit(f"    ... and {summary.total - len(summary.listed)} more. By top-level directory:")
+        groups = sorted(summary.groups.items(), key=lambda item: item[1][1], reverse=True)
+        for top, (count, size) in groups[:UNTRACKED_LIMIT]:
+            emit(f"      {top:<30} {count:>7} entries  {format_size(size):>10}")
+        if len(groups) > UNTRACKED_LIMIT:
+            emit(f"      ... and {len(groups) - UNTRACKED_LIMIT} more directories")
+
+def wip_repo(repo_path):
+    emit(f"Processing repository: {repo_path}")
+    state = probe_repo(repo_path)
+    if not state.clean and _wip_handled is not None and (
+            is_wip_branch(state.branch) or _wip_handled.get(repo_path) == state.oid):
+        emit(f"  Repository '{repo_path}' is still dirty; its work is already on a WIP branch.")
+    elif not state.clean:
+        handle_wip_dirty(repo_path, state)
+        if _wip_handled is not None:
+            _wip_handled[repo_path] = state.oid
+    else:
+        handle_wip_clean(repo_path, state)
+    if not DRY_RUN:
+        check_unchecked_files(repo_path)
+    elif VERBOSE:
+        verbose_print(f"Dry-run: Would check for unchecked files in '{repo_path}'.")
+    emit("")
+
+def _finish_repo(run):
+    output = run.finish()
+    if output:
+        with _print_lock:
+            HUMAN_OUT.write(output)
+            HUMAN_OUT.flush()
+    if REPORT:
+        REPORT.add(run.record)
+    if JOURNAL:
+        JOURNAL.record(run.record["repo"], not run.failed)
+    _observed_durations.setdefault(run.record["action"], {})[run.record["repo"]] = run.record["wall_time"]
+    return run.failed
+
+def action_name(handler):
+    # fetch_repo_async -> fetch, wip_repo -> wip
+    return handler.__name__.replace('_async', '').replace('_repo', '')
+
+def wants_final_state():
+    # Handlers probe before they act (--fetch not at all); re-probe afterwards
+    # so the report shows the state the run left the repository in. The
+    # re-probe is the report's own cost, so it isn't timed or counted.
+    return REPORT is not None and not DRY_RUN
+
+def _run_repo(handler, repo_path, buffered):
+    run = RepoRun(repo_path, action_name(handler), buffered)
+    _current_run.set(run)
+    try:
+        handler(repo_path)
+        if wants_final_state():
+            run.ended = time.monotonic()
+            token = _uncounted.set(True)
+            try:
+                probe_repo(repo_path)
+            finally:
+                _uncounted.reset(token)
+    except Exception as e:
+        run.failed = True
+        emit(f"Error in '{repo_path}': {e}")
+    return run
+
+def run_repos(repo_paths, handler, jobs=1):
+    """Run handler over every repo, returning the number of repos that failed.
+
+    With more than one job each repo's output is collected and printed as one
+    block once that repo finishes, so parallel workers never interleave.
+    """
+    failures = 0
+    if jobs <= 1:
+        for repo_path in repo_paths:
+            failures += _finish_repo(contextvars.copy_context().run(_run_repo, handler, repo_path, False))
+        return failures
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, _run_repo, handler, repo_path, True)
+                   for repo_path in repo_paths]
+        for future in as_completed(futures):
+            failures += _finish_repo(future.result())
+    return failures
+
+async def _run_repo_async(handler, repo_path, buffered, slots):
+    async with slots:
+        run = RepoRun(repo_path, action_name(handler), buffered)
+        _current_run.set(run)
+        try:
+            await handler(repo_path)
+            if wants_final_state():
+                run.ended = time.monotonic()
+                token = _uncounted.set(True)
+                try:
+                    # probe_repo() blocks on the engine loop, so run it off-loop.
+                    await asyncio.to_thread(probe_repo, repo_path)
+                finally:
+                    _uncounted.reset(token)
+        except Exception as e:
+            run.failed = True
+            emit(f"Error in '{repo_path}': {e}")
+    return _finish_repo(run)
+
+async def _gather_repos(repo_paths, handler, jobs):
+    slots = asyncio.Semaphore(max(1, jobs))
+    if jobs <= 1:
+        return [await _run_repo_async(handler, repo_path, False, slots) for repo_path in repo_paths]
+    return await asyncio.gather(*(_run_repo_async(handler, repo_path, True, slots) for repo_path in repo_paths))
+
+def run_repos_async(repo_paths, handler, jobs=1):
+    """Like run_repos(), but handler is a coroutine function and every repo
+    runs as a task on the engine loop instead of occupying a thread."""
+    return sum(run_in_engine(_gather_repos(repo_paths, handler, jobs)))
+
+class Journal:
+    """Checkpoints for one action's run in JOURNAL_FILE.
+
+    Each line is a JSON event: a "start", one "repo" per finished repository
+    (with ok true/false) and an "end" once the run completes. A run without
+    an "end" was interrupted and can be resumed.
+    """
+
+    def __init__(self, action):
+        self.action = action
+        self.run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{os.getpid()}"
+        self.lock = threading.Lock()
+        self.events = []
+        self.torn = False
+        try:
+            with open(JOURNAL_FILE) as f:
+                for line in f:
+                    # A line cut short by the interruption we may be resuming from.
+                    self.torn = not line.endswith("\n")
+                    try:
+                        self.events.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+
+    def last_run(self):
+        runs = [e for e in self.events if e.get("action") == self.action and e.get("event") == "start"]
+        if not runs:
+            return None, {}, False
+        run_id = runs[-1]["run"]
+        results = {}
+        ended = False
+        for event in self.events:
+            if event.get("run") == run_id:
+                if event.get("event") == "repo":
+                    results[event["repo"]] = event["ok"]
+                ended = ended or event.get("event") == "end"
+        return run_id, results, ended
 
-def init_repos():
-    os.makedirs(CONFIG_DIR, exist_ok=True)
-    http_repos = []
-    ssh_repos = []
-    for repo_path in find_git_repos():
-        if is_http_remote(repo_path):
-            http_repos.append(repo_path)
+    def select(self, repo_paths, resume=False, retry_failed=False):
+        """Pick the repos this run should process and write its start event."""
+        run_id, results, ended = self.last_run()
+        if resume and run_id and not ended:
+            self.run_id = run_id
+            emit(f"Resuming interrupted {self.action} run {run_id}: {sum(results.values())} repositories already done.")
+            return [path for path in repo_paths if not results.get(path)]
+        if retry_failed:
+            failed = {path for path, ok in results.items() if not ok}
+            emit(f"Retrying {len(failed)} repositories that failed in {self.action} run {run_id or '(none)'}.")
+            repo_paths = [path for path in repo_paths if path in failed]
+        elif resume:
+            emit(f"No interrupted {self.action} run to resume; processing everything.")
+        self.compact()
+        self.append({"event": "start", "repos": len(repo_paths)})
+        return repo_paths
+
+    def compact(self):
+        # Keep only the latest run of every action so the journal stays small.
+        latest = {}
+        for event in self.events:
+            if event.get("event") == "start":
+                latest[event.get("action")] = event.get("run")
+        kept = [e for e in self.events if latest.get(e.get("action")) == e.get("run")]
+        if len(kept) == len(self.events):
+            return
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CONFIG_DIR, prefix='.journal-')
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(json.dumps(event) + "\n" for event in kept)
+        os.replace(tmp_path, JOURNAL_FILE)
+        self.events = kept
+        self.torn = False
+
+    def append(self, event):
+        event = {"run": self.run_id, "action": self.action, "time": time.time(), **event}
+        with self.lock:
+            os.makedirs(CONFIG_DIR, exist_ok=True)
+            with open(JOURNAL_FILE, 'a') as f:
+                f.write(("\n" if self.torn else "") + json.dumps(event) + "\n")
+            self.torn = False
+
+    def record(self, repo_path, ok):
+        self.append({"event": "repo", "repo": repo_path, "ok": ok})
+
+    def finish(self):
+        self.append({"event": "end"})
+
+def load_durations():
+    try:
+        with open(DURATIONS_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_durations():
+    durations = load_durations()
+    for action, observed in _observed_durations.items():
+        known = durations.setdefault(action, {})
+        for repo_path, seconds in observed.items():
+            # Exponential moving average so one slow run doesn't dominate.
+            previous = known.get(repo_path)
+            known[repo_path] = round(seconds if previous is None else 0.5 * previous + 0.5 * seconds, 4)
+    write_json_atomic(DURATIONS_FILE, durations)
+    _observed_durations.clear()
+
+def index_mtime(repo_path):
+    try:
+        return os.stat(os.path.join(repo_path, '.git', 'index')).st_mtime
+    except OSError:
+        return 0
+
+def order_repos(action, repo_paths):
+    """Longest-expected-first ordering from the durations of earlier runs.
+
+    Starting the slowest repos first keeps one big repo from finishing last
+    and stretching the whole parallel run. Repos with no history are assumed
+    to take the average time. For --wip, repos whose index changed within
+    RECENT_SECONDS go first, most recent first.
+    """
+    if ORDER != 'priority':
+        return repo_paths
+    known = load_durations().get(action, {})
+    default = sum(known.values()) / len(known) if known else 0.0
+    ordered = sorted(repo_paths, key=lambda path: (-known.get(path, default), path))
+    if action != 'wip':
+        return ordered
+    cutoff = time.time() - RECENT_SECONDS
+    touched = {path: index_mtime(path) for path in ordered}
+    recent = sorted((path for path in ordered if touched[path] >= cutoff), key=lambda path: -touched[path])
+    return recent + [path for path in ordered if touched[path] < cutoff]
+
+def run_journaled(action, handler, jobs, runner=run_repos):
+    """Run an action through `runner`, checkpointing every finished repo so an
+    interrupted run can be continued with --resume or --retry-failed."""
+    global JOURNAL
+    repo_paths = find_git_repos()
+    if DRY_RUN:
+        return runner(order_repos(action, repo_paths), handler, jobs)
+    journal = Journal(action)
+    repo_paths = order_repos(action, journal.select(repo_paths, RESUME, RETRY_FAILED))
+    JOURNAL = journal
+    try:
+        failures = runner(repo_paths, handler, jobs)
+        journal.finish()
+    finally:
+        JOURNAL = None
+        save_durations()
+    return failures
+
+def configure_slots(network_jobs, local_jobs, max_processes=None, timeout=None, host_jobs=HOST_JOBS):
+    global NETWORK_JOBS
+    global LOCAL_JOBS
+    global HOST_JOBS
+    global MAX_GIT_PROCESSES
+    global GIT_TIMEOUT
+    NETWORK_JOBS = network_jobs
+    LOCAL_JOBS = local_jobs
+    HOST_JOBS = host_jobs
+    MAX_GIT_PROCESSES = max_processes or MAX_GIT_PROCESSES
+    GIT_TIMEOUT = timeout
+
+def git_config_mtime(repo_path):
+    try:
+        return os.stat(os.path.join(repo_path, '.git', 'config')).st_mtime_ns
+    except OSError:
+        return None
+
+def init_repos(jobs=1):
+    """Classify repositories by origin URL type and fetch the HTTP ones.
+
+    Repos already in megagit.json whose .git/config hasn't changed since they
+    were classified are kept as they are; only new or changed repos are
+    classified again and fetched, in parallel.
+    """
+    # Discovery saves its cache to megagit.json, so read the config after it.
+    repo_paths = find_git_repos()
+    known = load_config().get("repos", {})
+    repos = {}
+    pending = []
+    for repo_path in repo_paths:
+        entry = known.get(repo_path)
+        if entry and entry.get("config_mtime") == git_config_mtime(repo_path):
+            repos[repo_path] = entry
+        else:
+            pending.append(repo_path)
+
+    def init_repo(repo_path):
+        config_mtime = git_config_mtime(repo_path)
+        origin_url = get_remote_urls(repo_path).get('origin', '')
+        if is_http_url(origin_url):
+            kind = "http"
             verbose_print(f"Found HTTP repo: {repo_path}")
             fetch_repo(repo_path)
-        elif is_ssh_remote(repo_path):
-            ssh_repos.append(repo_path)
+        elif is_ssh_url(origin_url):
+            kind = "ssh"
             verbose_print(f"Found SSH repo: {repo_path}")
+        else:
+            kind = "other"
+        repos[repo_path] = {"type": kind, "url": origin_url, "config_mtime": config_mtime}
+
+    failures = run_repos(pending, init_repo, jobs)
+    removed = len(set(known) - set(repos))
+    data = load_config()
+    data.update({
+        "http_repos": [path for path, entry in sorted(repos.items()) if entry["type"] == "http"],
+        "ssh_repos": [path for path, entry in sorted(repos.items()) if entry["type"] == "ssh"],
+        "repos": dict(sorted(repos.items())),
+    })
+    save_config(data)
+    emit(f"Git repository types saved to {JSON_FILE} ({len(pending)} new or changed, {removed} removed, "
+         f"{len(repos) - len(pending)} unchanged).")
+    return failures
+
+# inotify(7) flags used by --watch.
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# Only these entries in .git/ mean the repository changed; everything else
+# there (ORIG_HEAD, logs, lock files) is noise.
+GIT_DIR_TRIGGERS = {'HEAD', 'index'}
+
+def watched_dirs(repo_path):
+    pending = [repo_path]
+    while pending:
+        path = pending.pop()
+        yield path
+        try:
+            with os.scandir(path) as entries:
+                pending.extend(e.path for e in entries
+                               if e.is_dir(follow_symlinks=False) and e.name != '.git' and e.name not in PRUNE_DIRS)
+        except OSError:
+            continue
+
+def repo_signature(repo_path):
+    """Cheap change marker used when inotify isn't available: the newest
+    mtime in the working tree plus the .git/HEAD and .git/index mtimes."""
+    signature = []
+    for name in ('HEAD', 'index'):
+        try:
+            signature.append(os.stat(os.path.join(repo_path, '.git', name)).st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    newest = 0
+    for path in watched_dirs(repo_path):
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name != '.git':
+                        newest = max(newest, entry.stat(follow_symlinks=False).st_mtime_ns)
+        except OSError:
+            continue
+    return tuple(signature) + (newest,)
+
+class InotifyWatcher:
+    """Reports which repositories changed, using inotify on every working-tree
+    directory and on .git/ itself. Raises OSError when inotify is unusable."""
 
-    data = {"http_repos": http_repos, "ssh_repos": ssh_repos}
-    with open(JSON_FILE, 'w') as f:
-        json.dump(data, f, indent=2)
-    print(f"Git repository types saved to {JSON_FILE}")
+    def __init__(self, repo_paths):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify is not available on this platform")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+        self.unwatched = set()
+        for repo_path in repo_paths:
+            self.add(os.path.join(repo_path, '.git'), repo_path)
+            for path in watched_dirs(repo_path):
+                self.add(path, repo_path)
+
+    def add(self, path, repo_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            # Usually fs.inotify.max_user_watches; poll this repo instead.
+            self.unwatched.add(repo_path)
+            return
+        self.watches[wd] = (path, repo_path)
+
+    def changed(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        changed = set()
+        if not ready:
+            return changed
+        data = os.read(self.fd, 65536)
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, _, name_len = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + name_len].rstrip(b'\0').decode(errors='replace')
+            offset += 16 + name_len
+            if mask & IN_Q_OVERFLOW:
+                changed.update(repo for _, repo in self.watches.values())
+                continue
+            if wd not in self.watches:
+                continue
+            path, repo_path = self.watches[wd]
+            if os.path.basename(path) == '.git':
+                if name in GIT_DIR_TRIGGERS:
+                    changed.add(repo_path)
+                continue
+            changed.add(repo_path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and name not in PRUNE_DIRS:
+                for new_path in watched_dirs(os.path.join(path, name)):
+                    self.add(new_path, repo_path)
+        return changed
+
+class PollingWatcher:
+    """Fallback watcher comparing repo_signature() snapshots every interval."""
+
+    def __init__(self, repo_paths, interval):
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.signatures = {repo_path: repo_signature(repo_path) for repo_path in repo_paths}
+
+    def refresh(self, repo_paths):
+        for repo_path in repo_paths:
+            if repo_path in self.signatures:
+                self.signatures[repo_path] = repo_signature(repo_path)
+
+    def remaining(self):
+        return max(0.0, self.next_poll - time.monotonic())
+
+    def changed(self):
+        if self.remaining() > 0:
+            return set()
+        self.next_poll = time.monotonic() + self.interval
+        changed = set()
+        for repo_path, old in self.signatures.items():
+            new = repo_signature(repo_path)
+            if new != old:
+                self.signatures[repo_path] = new
+                changed.add(repo_path)
+        return changed
+
+def watch_repos(jobs=1, debounce=5.0, poll_interval=30.0, polling=False):
+    """Run the WIP pipeline for repositories as they change, until interrupted.
+
+    A repo is processed once it has been quiet for `debounce` seconds. Events
+    in the `debounce` seconds after a pass may be megagit's own git commands,
+    so they are held back and only count if repo_signature() has moved once
+    that window ends.
+    """
+    global _wip_handled
+    _wip_handled = {}
+    repo_paths = find_git_repos()
+    inotify = poller = None
+    if not polling:
+        try:
+            inotify = InotifyWatcher(repo_paths)
+            if inotify.unwatched:
+                emit(f"Watch limit reached; polling {len(inotify.unwatched)} repositories instead.")
+                poller = PollingWatcher(inotify.unwatched, poll_interval)
+        except (OSError, AttributeError) as e:
+            emit(f"inotify unavailable ({e}); falling back to polling every {poll_interval}s.")
+    if inotify is None:
+        poller = PollingWatcher(repo_paths, poll_interval)
+    emit(f"Watching {len(repo_paths)} repositories for changes...")
+
+    dirty = {}
+    ignore_until = {}
+    settled = {}
+    held = {}
+    failures = 0
+    try:
+        while True:
+            now = time.monotonic()
+            waits = [max(0.0, debounce - (now - seen)) for seen in dirty.values()]
+            waits += [max(0.0, ignore_until[repo_path] - now) for repo_path in held]
+            if poller:
+                waits.append(poller.remaining())
+            timeout = min(waits) if waits else None
+            if inotify:
+                changed = inotify.changed(timeout)
+            else:
+                time.sleep(timeout)
+                changed = set()
+            if poller:
+                changed |= poller.changed()
+
+            now = time.monotonic()
+            for repo_path in changed:
+                if now >= ignore_until.get(repo_path, 0):
+                    dirty[repo_path] = now
+                else:
+                    held[repo_path] = now
+            for repo_path in [repo for repo in held if now >= ignore_until[repo]]:
+                seen = held.pop(repo_path)
+                if repo_signature(repo_path) != settled.pop(repo_path, None):
+                    dirty[repo_path] = max(seen, dirty.get(repo_path, seen))
+            ready = sorted(repo for repo, seen in dirty.items() if now - seen >= debounce)
+            if ready:
+                for repo_path in ready:
+                    del dirty[repo_path]
+                failures += run_repos(ready, wip_repo, jobs)
+                if poller:
+                    poller.refresh(ready)
+                done = time.monotonic()
+                for repo_path in ready:
+                    ignore_until[repo_path] = done + debounce
+                    settled[repo_path] = repo_signature(repo_path)
+                    held.pop(repo_path, None)
+    except KeyboardInterrupt:
+        emit("Stopped watching.")
+    return failures
 
 def main():
     global VERBOSE
     global DRY_RUN
+    global REBASE_MODE
+    global SKIP_UNCHANGED
+    global BACKEND
+    global UNTRACKED_LIMIT
+    global RESUME
+    global ORDER
+    global RECENT_SECONDS
+    global RETRY_FAILED
+    global MAINTAIN_LOOSE_OBJECTS
+    global MAINTAIN_PACKS
+    global MAINTAIN_JOBS
+    global ACCELERATE_FILES
+    global REPORT
+    global HUMAN_OUT
 
     parser = argparse.ArgumentParser(description="Manage multiple Git repositories.")
     parser.add_argument("--init", action="store_true", help="Initialize and categorize Git repositories.")
     parser.add_argument("--fetch", action="store_true", help="Fetch in all Git repositories.")
+    parser.add_argument("--skip-unchanged", action="store_true", help="Before --fetch, compare `git ls-remote` with the refs seen last time and skip repos where nothing moved.")
     parser.add_argument("--pull", action="store_true", help="Pull in clean Git repositories.")
     parser.add_argument("--wip", action="store_true", help="Handle work-in-progress.")
+    parser.add_argument("--maintain", action="store_true", help="Repack repositories with too many loose objects or packs and write missing commit-graphs.")
+    parser.add_argument("--loose-threshold", type=int, default=MAINTAIN_LOOSE_OBJECTS, help="Loose objects above which --maintain repacks a repository.")
+    parser.add_argument("--pack-threshold", type=int, default=MAINTAIN_PACKS, help="Pack files above which --maintain repacks a repository.")
+    parser.add_argument("--maintain-jobs", type=int, default=MAINTAIN_JOBS, help="Maximum repositories --maintain works on at once (also capped by --jobs).")
+    parser.add_argument("--accelerate", action="store_true", help="Enable the untracked cache, feature.manyFiles and fsmonitor (where supported) in large repositories.")
+    parser.add_argument("--accelerate-threshold", type=int, default=ACCELERATE_FILES, help="Tracked files a repository needs before --accelerate changes it.")
+    parser.add_argument("--watch", action="store_true", help="Keep running and handle work-in-progress for repositories as they change.")
+    parser.add_argument("--debounce", type=float, default=5.0, help="Seconds a repository must be quiet before --watch processes it.")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between scans when --watch has to poll instead of using inotify.")
+    parser.add_argument("--poll", action="store_true", help="Make --watch poll mtimes even when inotify is available.")
+    parser.add_argument("--rebase-mode", choices=["checkout", "refs"], default=REBASE_MODE,
+                        help="How --wip updates branches: 'checkout' rebases every branch with an origin counterpart, "
+                             "'refs' skips up-to-date branches, fast-forwards with update-ref and only checks out diverged ones.")
+    parser.add_argument("--backend", choices=["auto", "cli", "pygit2"], default=BACKEND,
+                        help="How read-only queries are answered: in-process with pygit2 ('auto' uses it when installed) or by running git.")
+    parser.add_argument("--untracked-limit", type=int, default=UNTRACKED_LIMIT, help="Maximum untracked paths listed per repository by --wip.")
+    parser.add_argument("--order", choices=["priority", "alpha"], default=ORDER,
+                        help="'priority' starts the repos that took longest last time first (recently touched repos first for --wip); 'alpha' uses path order.")
+    parser.add_argument("--recent", type=float, default=RECENT_SECONDS, help="Seconds since the last index change for --wip to treat a repository as recently touched.")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted --fetch/--pull/--wip/--maintain/--accelerate run, skipping repositories it already finished.")
+    parser.add_argument("--retry-failed", action="store_true", help="Only process repositories that failed in the last --fetch/--pull/--wip/--maintain/--accelerate run.")
+    parser.add_argument("--rescan", action="store_true", help="Ignore the repository discovery cache and walk the whole tree.")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of repositories to process in parallel.")
+    parser.add_argument("--network-jobs", type=int, help="Maximum concurrent network git commands (fetch/pull/push). Defaults to --jobs.")
+    parser.add_argument("--local-jobs", type=int, help="Maximum concurrent local git commands (status/rebase/...). Defaults to min(--jobs, CPU count).")
+    parser.add_argument("--host-jobs", type=int, default=HOST_JOBS, help="Maximum concurrent network git commands per remote host (0 for no limit).")
+    parser.add_argument("--no-ssh-multiplex", action="store_true", help="Don't share SSH connections (ControlMaster) between git commands.")
+    parser.add_argument("--max-processes", type=int, default=MAX_GIT_PROCESSES, help="Maximum git processes running at once across all repositories.")
+    parser.add_argument("--timeout", type=float, help="Kill any single git command that runs longer than this many seconds.")
+    parser.add_argument("--report", choices=["json", "ndjson"], help="Write a machine-readable run report with per-repo git timings.")
+    parser.add_argument("--report-file", default="-", help="Where to write the report ('-' for stdout, which moves normal output to stderr).")
+    parser.add_argument("--report-top", type=int, default=10, help="Number of slowest repositories listed in the report summary.")
     parser.add_argument("--dry-run", action="store_true", help="Perform a dry run without making changes.")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose output.")
     args = parser.parse_args()
 
     VERBOSE = args.verbose
     DRY_RUN = args.dry_run
+    REBASE_MODE = args.rebase_mode
+    SKIP_UNCHANGED = args.skip_unchanged
+    BACKEND = args.backend
+    UNTRACKED_LIMIT = args.untracked_limit
+    RESUME = args.resume
+    ORDER = args.order
+    RECENT_SECONDS = args.recent
+    RETRY_FAILED = args.retry_failed
+    MAINTAIN_LOOSE_OBJECTS = args.loose_threshold
+    MAINTAIN_PACKS = args.pack_threshold
+    MAINTAIN_JOBS = args.maintain_jobs
+    ACCELERATE_FILES = args.accelerate_threshold
+    if BACKEND == 'pygit2' and pygit2 is None:
+        emit("Warning: pygit2 is not installed; falling back to the git command line.")
+
+    jobs = max(1, args.jobs)
+    configure_slots(args.network_jobs or jobs, args.local_jobs or min(jobs, os.cpu_count() or 1),
+                    args.max_processes, args.timeout, args.host_jobs)
+
+    if args.report:
+        if args.report_file == '-':
+            HUMAN_OUT = sys.stderr
+            REPORT = Report(args.report, sys.stdout, args.report_top)
+        else:
+            REPORT = Report(args.report, open(args.report_file, 'w'), args.report_top)
+
+    if args.rescan:
+        find_git_repos(rescan=True)
 
     action_performed = False
+    failures = 0
+    uses_network = args.init or args.fetch or args.pull or args.wip or args.watch
+    control_dir = start_ssh_multiplexing() if uses_network and not args.no_ssh_multiplex and not DRY_RUN else None
 
-    if args.init:
-        action_performed = True
-        init_repos()
-    if args.fetch:
-        action_performed = True
-        print("Fetching all repositories...")
-        for repo_path in find_git_repos():
-            fetch_repo(repo_path)
-    if args.pull:
-        action_performed = True
-        print("Pulling in clean repositories...")
-        for repo_path in find_git_repos():
-            pull_repo(repo_path)
-    if args.wip:
-        action_performed = True
-        print("Processing work-in-progress...")
-        for repo_path in find_git_repos():
-            print(f"Processing repository: {repo_path}")
-            if not is_repo_clean(repo_path):
-                handle_wip_dirty(repo_path)
-            else:
-                handle_wip_clean(repo_path)
-            if not DRY_RUN:
-                check_unchecked_files(repo_path)
-            elif VERBOSE:
-                verbose_print(f"Dry-run: Would check for unchecked files in '{repo_path}'.")
-            print("")
+    try:
+        if args.init:
+            action_performed = True
+            failures += init_repos(jobs)
+        if args.fetch:
+            action_performed = True
+            emit("Fetching all repositories...")
+            failures += fetch_repos(jobs)
+        if args.pull:
+            action_performed = True
+            emit("Pulling in clean repositories...")
+            failures += run_journaled('pull', pull_repo, jobs)
+        if args.wip:
+            action_performed = True
+            emit("Processing work-in-progress...")
+            failures += run_journaled('wip', wip_repo, jobs)
+        if args.maintain:
+            action_performed = True
+            emit("Maintaining repositories...")
+            failures += maintain_repos(jobs)
+        if args.accelerate:
+            action_performed = True
+            emit("Accelerating large repositories...")
+            failures += accelerate_repos(jobs)
+        if args.watch:
+            action_performed = True
+            failures += watch_repos(jobs, args.debounce, args.poll_interval, args.poll)
+    finally:
+        stop_ssh_multiplexing(control_dir)
+
+    if REPORT:
+        REPORT.close()
 
     if not action_performed:
         parser.print_help()
+    elif failures:
+        emit(f"{failures} repositor{'y' if failures == 1 else 'ies'} reported errors.")
+        return 1
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
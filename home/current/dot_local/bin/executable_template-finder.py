@@ -1,52 +1,717 @@
 #!/usr/bin/env python
+import io
 import os
 import re
+import sqlite3
+import subprocess
+import sys
 import hashlib
+import heapq
+import keyword
+import tokenize
 import argparse
-from collections import defaultdict
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from functools import lru_cache
+from itertools import chain, combinations
 
-def normalize_code(code):
-    # Strip comments, whitespace, and normalize identifiers
-    code = re.sub(r'#.*', '', code)  # remove comments
-    code = re.sub(r'\s+', ' ', code)  # collapse whitespace
-    code = re.sub(r'\b\w+\b', 'VAR', code)  # normalize identifiers
-    return code.strip()
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
-def hash_window(tokens, start, size):
-    window = ' '.join(tokens[start:start+size])
-    return hashlib.md5(window.encode()).hexdigest()
+# Keywords of the C-family languages handled by lex_generic(); any other
+# word is an identifier and normalized to VAR.
+C_KEYWORDS = frozenset("""
+    abstract as async await auto bool boolean break byte case catch char class const constexpr continue
+    default defer delete do double else enum export extends extern false fallthrough final finally float
+    fn for func function go goto if impl implements import in inline instanceof int interface let long
+    loop match mod mut namespace new nil null operator override package private protected pub public
+    range register return select self short signed sizeof static struct super switch template this
+    throw throws trait true try type typedef typeof union unsafe unsigned use using var virtual void
+    volatile where while yield
+""".split())
 
-def extract_templates(file_paths, window_size=10, min_occurrences=2):
-    hash_map = defaultdict(list)
+# Token patterns for lex_generic(), tried in order at every position.
+GENERIC_TOKEN_RE = r"""
+    (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+  | (?P<number>\.?\d[\w.]*)
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<op>>>>=|<<=|>>=|===|!==|\.\.\.|->|=>|::|\+\+|--|&&|\|\||[-+*/%&|^!=<>]=|<<|>>|\S)
+"""
+C_LIKE_RE = re.compile(r"(?P<comment>//[^\n]*|/\*.*?\*/)|" + GENERIC_TOKEN_RE, re.S | re.X)
+HASH_COMMENT_RE = re.compile(r"(?P<comment>\#[^\n]*)|" + GENERIC_TOKEN_RE, re.S | re.X)
+HASH_COMMENT_EXTENSIONS = {'.sh', '.bash', '.zsh', '.rb', '.pl', '.pm', '.r', '.ps1', '.yaml', '.yml', '.toml', '.cmake', '.mk'}
 
-    for path in file_paths:
-        with open(path, 'r', encoding='utf-8') as f:
-            raw = f.read()
-            norm = normalize_code(raw)
-            tokens = norm.split()
+def lex_generic(code, pattern=C_LIKE_RE):
+    """Tokens and their 1-based line numbers, with comments dropped,
+    identifiers and numbers normalized to VAR and strings to STRING."""
+    tokens = []
+    lines = []
+    line = 1
+    position = 0
+    for match in pattern.finditer(code):
+        line += code.count('\n', position, match.start())
+        position = match.start()
+        kind = match.lastgroup
+        text = match.group()
+        if kind == 'string':
+            tokens.append('STRING')
+        elif kind == 'number' or (kind == 'word' and text not in C_KEYWORDS):
+            tokens.append('VAR')
+        elif kind != 'comment':
+            tokens.append(text)
+        else:
+            continue
+        lines.append(line)
+    return tokens, lines
 
-            for i in range(len(tokens) - window_size + 1):
-                h = hash_window(tokens, i, window_size)
-                hash_map[h].append((path, i))
+PYTHON_SKIPPED = {tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.INDENT, tokenize.DEDENT,
+                  tokenize.ENCODING, tokenize.ENDMARKER}
+FSTRING_START = getattr(tokenize, 'FSTRING_START', None)
+FSTRING_END = getattr(tokenize, 'FSTRING_END', None)
+
+def lex_python(code):
+    tokens = []
+    lines = []
+    fstring_depth = 0
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        # Python 3.12+ splits f-strings into parts; keep them one STRING.
+        if token.type == FSTRING_START:
+            fstring_depth += 1
+            if fstring_depth == 1:
+                tokens.append('STRING')
+                lines.append(token.start[0])
+            continue
+        if token.type == FSTRING_END:
+            fstring_depth -= 1
+            continue
+        if fstring_depth or token.type in PYTHON_SKIPPED:
+            continue
+        if token.type == tokenize.NAME:
+            tokens.append(token.string if keyword.iskeyword(token.string) else 'VAR')
+        elif token.type == tokenize.NUMBER:
+            tokens.append('VAR')
+        elif token.type == tokenize.STRING:
+            tokens.append('STRING')
+        else:
+            tokens.append(token.string)
+        lines.append(token.start[0])
+    return tokens, lines
+
+def lexer_name(path):
+    """Which lexer tokenize_code() picks for path, from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.py', '.pyw', '.pyi'):
+        return 'python'
+    if extension in HASH_COMMENT_EXTENSIONS:
+        return 'hash'
+    return 'c'
+
+def tokenize_code(code, path=''):
+    """Normalized tokens of a source file and the line each one starts on.
+
+    Keywords and operators are kept as written; identifiers and numbers
+    become VAR and string literals STRING. Python goes through the tokenize
+    module, everything else through a C-like lexer (or one with # comments).
+    """
+    lexer = lexer_name(path)
+    if lexer == 'python':
+        try:
+            return lex_python(code)
+        except (tokenize.TokenError, SyntaxError):
+            # Not valid Python 3 (e.g. Python 2); lex it generically instead.
+            return lex_generic(code, HASH_COMMENT_RE)
+    if lexer == 'hash':
+        return lex_generic(code, HASH_COMMENT_RE)
+    return lex_generic(code)
+
+# Rabin-Karp rolling hash over token IDs, modulo the Mersenne prime 2^61 - 1.
+HASH_MOD = (1 << 61) - 1
+HASH_BASE = 1000003
+
+@lru_cache(maxsize=None)
+def token_id(token):
+    # A digest rather than hash(): it must be the same in every process.
+    return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little') % HASH_MOD
+
+def rolling_hashes(ids, size):
+    """Yield the hash of every `size`-token window of ids, in O(1) per slide."""
+    if size <= 0 or len(ids) < size:
+        return
+    high = pow(HASH_BASE, size - 1, HASH_MOD)
+    h = 0
+    for t in ids[:size]:
+        h = (h * HASH_BASE + t) % HASH_MOD
+    yield h
+    for i in range(size, len(ids)):
+        h = ((h - ids[i - size] * high) * HASH_BASE + ids[i]) % HASH_MOD
+        yield h
+
+def glob_to_regex(pattern):
+    """Translate a gitignore-style glob (with ** across directories) to a regex."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            end = pattern.index(']', i + 1)
+            regex += '[' + pattern[i + 1:end].replace('\\', '\\\\').replace('!', '^', 1) + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+def read_gitignore(directory):
+    """Rules of directory/.gitignore as (regex, negated, directory_only, anchored)."""
+    rules = []
+    try:
+        with open(os.path.join(directory, '.gitignore'), encoding='utf-8', errors='replace') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return rules
+    for line in lines:
+        line = line.rstrip()
+        if not line or line.startswith('#'):
+            continue
+        negated = line.startswith('!')
+        line = line[1:] if negated else line.lstrip('\\')
+        directory_only = line.endswith('/')
+        line = line.rstrip('/')
+        # A slash anywhere but the end ties the pattern to this directory.
+        anchored = '/' in line
+        rules.append((glob_to_regex(line.lstrip('/')), negated, directory_only, anchored))
+    return rules
+
+def is_ignored(rules, relative, name, is_dir):
+    # The last matching rule wins, as in git.
+    ignored = False
+    for base, (regex, negated, directory_only, anchored) in rules:
+        if directory_only and not is_dir:
+            continue
+        if anchored:
+            target = relative[len(base) + 1:] if base else relative
+        else:
+            target = name
+        if regex.match(target):
+            ignored = not negated
+    return ignored
+
+def walk_files(root):
+    """Files under root, honoring .gitignore files found on the way down."""
+    stack = [('', [])]
+    while stack:
+        relative_dir, rules = stack.pop()
+        directory = os.path.join(root, relative_dir)
+        rules = rules + [(relative_dir, rule) for rule in read_gitignore(directory)]
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        subdirs = []
+        for entry in entries:
+            if entry.name == '.git':
+                continue
+            relative = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            is_dir = entry.is_dir(follow_symlinks=False)
+            if is_ignored(rules, relative, entry.name, is_dir):
+                continue
+            if is_dir:
+                subdirs.append((relative, rules))
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path
+        stack.extend(reversed(subdirs))
+
+def git_files(directory):
+    """Tracked and untracked-but-not-ignored files under a directory inside a
+    git work tree, streamed from `git ls-files`; None outside one."""
+    try:
+        inside = subprocess.run(['git', '-C', directory, 'rev-parse', '--is-inside-work-tree'],
+                                capture_output=True, text=True)
+    except OSError:
+        return None
+    if inside.stdout.strip() != 'true':
+        return None
+
+    def generate():
+        process = subprocess.Popen(['git', '-C', directory, 'ls-files', '-z', '-co', '--exclude-standard'],
+                                   stdout=subprocess.PIPE)
+        partial_name = b''
+        try:
+            for chunk in iter(lambda: process.stdout.read(65536), b''):
+                names = (partial_name + chunk).split(b'\0')
+                partial_name = names.pop()
+                for name in names:
+                    path = os.path.join(directory, os.fsdecode(name))
+                    # Deleted but still tracked files and submodules are listed too.
+                    if os.path.isfile(path):
+                        yield path
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+    return generate()
+
+def is_binary(path):
+    # Raises OSError for unreadable files, so they aren't mistaken for binaries.
+    with open(path, 'rb') as f:
+        return b'\0' in f.read(8192)
+
+def warn(message):
+    print(f"Warning: {message}", file=sys.stderr)
+
+def discover_files(paths, extensions=(), includes=(), excludes=(), max_size=None):
+    """Yield the source files to scan, as they are found.
+
+    Files given explicitly are always scanned (unless binary); directories are
+    listed with `git ls-files` inside a work tree, or walked honoring
+    .gitignore otherwise, and filtered by extension, include/exclude globs,
+    size and a NUL-byte sniff for binaries.
+    """
+    extensions = {ext.lower() if ext.startswith('.') else '.' + ext.lower() for ext in extensions}
+    includes = [glob_to_regex(pattern) for pattern in includes]
+    excludes = [glob_to_regex(pattern) for pattern in excludes]
+
+    def wanted(path, root):
+        relative = os.path.relpath(path, root).replace(os.sep, '/')
+        name = os.path.basename(path)
+        if extensions and os.path.splitext(name)[1].lower() not in extensions:
+            return False
+        if includes and not any(regex.match(relative) or regex.match(name) for regex in includes):
+            return False
+        if any(regex.match(relative) or regex.match(name) for regex in excludes):
+            return False
+        try:
+            if max_size is not None and os.path.getsize(path) > max_size:
+                return False
+            binary = is_binary(path)
+        except OSError as e:
+            warn(f"skipping {path}: {e.strerror}")
+            return False
+        return not binary
+
+    for path in paths:
+        if not os.path.isdir(path):
+            try:
+                binary = is_binary(path)
+            except OSError as e:
+                warn(f"skipping {path}: {e.strerror}")
+                continue
+            if not binary:
+                yield path
+            continue
+        files = git_files(path)
+        for file_path in files if files is not None else walk_files(path):
+            if wanted(file_path, path):
+                yield os.path.normpath(file_path)
+
+def split_collisions(index, positions, token_ids, window_size):
+    # Group windows by their actual tokens, so distinct windows that happen
+    # to share a hash are not reported as one template.
+    groups = defaultdict(list)
+    for position in positions:
+        i = index.offsets[position]
+        groups[token_ids[index.file_ids[position]][i:i+window_size].tobytes()].append(position)
+    return list(groups.values())
+
+def scan_file(path, window_size, keep_ids=False):
+    """Window hashes of one file as an array indexed by token offset, the
+    source line of every token, and the token IDs themselves when they are
+    needed for --verify or the --index cache."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        raw = f.read()
+    tokens, lines = tokenize_code(raw, path)
+    ids = array('Q', (token_id(t) for t in tokens))
+    hashes = array('Q', rolling_hashes(ids, window_size))
+    return path, hashes, array('I', lines), ids if keep_ids else None
+
+# Bump whenever tokenizing or hashing changes, so old --index entries are ignored.
+INDEX_VERSION = 2
+
+class FingerprintCache:
+    """SQLite store of scan_file() results for --index.
+
+    Fingerprints are keyed by a digest of the file content and the scan
+    parameters, including the lexer the file's extension selects; a file whose mtime and size are unchanged since the last run
+    isn't even read again.
+    """
+
+    def __init__(self, path, window_size):
+        self.params = f"v{INDEX_VERSION}:window={window_size}"
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, digest TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS fingerprints (digest TEXT, params TEXT, hashes BLOB, lines BLOB, ids BLOB, "
+                        "PRIMARY KEY (digest, params))")
+        self.digests = {}
+
+    def get(self, path):
+        st = os.stat(path)
+        row = self.db.execute("SELECT mtime_ns, size, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[:2] == (st.st_mtime_ns, st.st_size):
+            digest = row[2]
+        else:
+            with open(path, 'rb') as f:
+                digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+            self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", (path, st.st_mtime_ns, st.st_size, digest))
+        self.digests[path] = digest
+        row = self.db.execute("SELECT hashes, lines, ids FROM fingerprints WHERE digest = ? AND params = ?",
+                              (digest, self.file_params(path))).fetchone()
+        if row is None:
+            return None
+        hashes, lines, ids = array('Q'), array('I'), array('Q')
+        hashes.frombytes(row[0])
+        lines.frombytes(row[1])
+        ids.frombytes(row[2])
+        return path, hashes, lines, ids
+
+    def file_params(self, path):
+        return f"{self.params}:lexer={lexer_name(path)}"
+
+    def put(self, path, hashes, lines, ids):
+        self.db.execute("INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                        (self.digests[path], self.file_params(path), hashes.tobytes(), lines.tobytes(), ids.tobytes()))
+
+    def close(self):
+        # Forget files this run didn't see (deleted or renamed ones), then
+        # the fingerprints no remaining file has.
+        self.db.execute("CREATE TEMP TABLE seen (path TEXT PRIMARY KEY)")
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", ((path,) for path in self.digests))
+        self.db.execute("DELETE FROM files WHERE path NOT IN (SELECT path FROM seen)")
+        self.db.execute("DELETE FROM fingerprints WHERE digest NOT IN (SELECT digest FROM files)")
+        self.db.commit()
+        self.db.close()
+
+def scan_batch(paths, window_size, keep_ids=False):
+    return [scan_file(path, window_size, keep_ids) for path in paths]
+
+# Files handed to a --jobs worker at a time, and how many batches may be
+# queued before discovery waits for the workers to catch up.
+SCAN_BATCH = 16
+SCAN_BACKLOG = 4
+
+def scan_files(file_paths, window_size, keep_ids=False, jobs=1, cache=None):
+    """Yield scan_file() results for file_paths, in completion order.
+
+    file_paths may be a generator that is still discovering files: batches go
+    to the workers as soon as they fill, so scanning overlaps with discovery.
+    """
+    keep_ids = keep_ids or cache is not None
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    pending = set()
+    batch = []
+
+    def store(results):
+        for result in results:
+            if cache:
+                cache.put(*result)
+            yield result
+
+    def finished(futures):
+        # Workers send back flat arrays, which pickle far smaller than
+        # lists of (path, offset) tuples.
+        for future in list(futures):
+            pending.discard(future)
+            yield from store(future.result())
+
+    try:
+        for path in file_paths:
+            cached = cache.get(path) if cache else None
+            if cached:
+                yield cached
+            elif executor is None:
+                yield from store([scan_file(path, window_size, keep_ids)])
+            else:
+                batch.append(path)
+                if len(batch) >= SCAN_BATCH:
+                    pending.add(executor.submit(scan_batch, batch, window_size, keep_ids))
+                    batch = []
+                if len(pending) >= jobs * SCAN_BACKLOG:
+                    yield from finished(wait(pending, return_when=FIRST_COMPLETED).done)
+                else:
+                    yield from finished([future for future in pending if future.done()])
+        if batch:
+            pending.add(executor.submit(scan_batch, batch, window_size, keep_ids))
+        yield from finished(as_completed(list(pending)))
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+def winnow(hashes, guard):
+    """Token offsets of the fingerprints winnowing keeps: the rightmost
+    minimum hash of every `guard` consecutive windows (Schleimer et al.,
+    MOSS). Any match spanning at least `guard` windows shares one of them."""
+    selected = array('I')
+    candidates = deque()  # offsets whose hashes increase from front to back
+    for i, h in enumerate(hashes):
+        while candidates and hashes[candidates[-1]] >= h:
+            candidates.pop()
+        candidates.append(i)
+        if candidates[0] <= i - guard:
+            candidates.popleft()
+        if i >= guard - 1 and (not selected or selected[-1] != candidates[0]):
+            selected.append(candidates[0])
+    if hashes and not selected:
+        # Shorter than one guard window: keep its overall rightmost minimum.
+        selected.append(candidates[0])
+    return selected
+
+class HashIndex:
+    """Every window hash as parallel columns (hash, file ID, token offset)
+    instead of a dict of per-hash lists of (path, offset) tuples."""
+
+    def __init__(self):
+        self.paths = []
+        self.hashes = array('Q')
+        self.file_ids = array('I')
+        self.offsets = array('I')
+        # Each file's windows occupy one contiguous [begin, end) range of the columns.
+        self.ranges = []
+
+    def add(self, path, hashes, offsets=None):
+        file_id = len(self.paths)
+        self.paths.append(path)
+        self.ranges.append((len(self.hashes), len(self.hashes) + len(hashes)))
+        self.hashes.extend(hashes)
+        self.file_ids.extend(array('I', [file_id]) * len(hashes))
+        self.offsets.extend(range(len(hashes)) if offsets is None else offsets)
+
+    def groups(self, min_occurrences):
+        """Yield (hash, [position, ...]) for every hash shared by at least
+        min_occurrences windows, found by sorting on hash and one scan.
+        Positions index the columns and are in (file, offset) order."""
+        if not self.hashes:
+            return
+        if np is not None:
+            yield from self._groups_numpy(min_occurrences)
+            return
+        # Without numpy, sort each file's windows on their own and merge the
+        # files lazily: only one file's worth of Python ints exists at a time.
+        hashes = self.hashes
+        orders = [array('I', sorted(range(begin, end), key=hashes.__getitem__)) for begin, end in self.ranges]
+        h, run = None, []
+        for position in heapq.merge(*orders, key=hashes.__getitem__):
+            if hashes[position] != h:
+                if len(run) >= min_occurrences:
+                    yield h, run
+                h, run = hashes[position], []
+            run.append(position)
+        if len(run) >= min_occurrences:
+            yield h, run
+
+    def _groups_numpy(self, min_occurrences):
+        hashes = np.frombuffer(self.hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+        sorted_hashes = hashes[order]
+        starts = np.flatnonzero(np.concatenate(([True], sorted_hashes[1:] != sorted_hashes[:-1])))
+        counts = np.diff(np.append(starts, len(sorted_hashes)))
+        keep = counts >= min_occurrences
+        for start, count in zip(starts[keep].tolist(), counts[keep].tolist()):
+            yield int(sorted_hashes[start]), order[start:start + count].tolist()
+
+# Hash groups up to this size seed the region search with every pair of
+# their windows. Larger ones (code that repeats many times) pair each window
+# with the group's first window only, plus the first windows of every file
+# with each other; extending those seeds recovers the rest of each match.
+PAIR_LIMIT = 8
+
+def seed_pairs(index, members):
+    if len(members) <= PAIR_LIMIT:
+        return combinations(members, 2)
+    firsts = {}
+    for position in members:
+        firsts.setdefault(index.file_ids[position], position)
+    return chain(((members[0], member) for member in members[1:]),
+                 combinations(list(firsts.values())[1:], 2))
+
+def clone_pairs(index, groups, window_size):
+    """Maximal duplicated regions seeded by the window hits in groups.
+
+    Two windows lie on a diagonal (file_a, file_b, offset_b - offset_a).
+    Each seed pair is extended backwards and forwards along its diagonal for
+    as long as the fingerprints keep matching, so a duplicated block comes
+    out as one region pair however its windows were grouped; seeds inside a
+    stretch already extended are skipped. With winnowing, neighbouring
+    fingerprints are up to the guard window apart; they still line up.
+    Yields ((file_a, start_a, end_a), (file_b, start_b, end_b)) in tokens.
+    """
+    hashes, offsets, file_ids = index.hashes, index.offsets, index.file_ids
+    extended = defaultdict(list)
+    for members in groups:
+        for a, b in seed_pairs(index, members):
+            file_a, file_b = file_ids[a], file_ids[b]
+            delta = offsets[b] - offsets[a]
+            diagonal = extended[(file_a, file_b, delta)]
+            if any(first <= a <= last for first, last in diagonal):
+                continue
+            (begin_a, end_a), (begin_b, end_b) = index.ranges[file_a], index.ranges[file_b]
+            first_a, first_b = a, b
+            while (first_a > begin_a and first_b > begin_b and hashes[first_a - 1] == hashes[first_b - 1]
+                   and offsets[first_b - 1] - offsets[first_a - 1] == delta):
+                first_a -= 1
+                first_b -= 1
+            last_a, last_b = a, b
+            while (last_b + 1 < end_b and last_a + 1 < end_a and hashes[last_a + 1] == hashes[last_b + 1]
+                   and offsets[last_b + 1] - offsets[last_a + 1] == delta):
+                last_a += 1
+                last_b += 1
+            diagonal.append((first_a, last_a))
+            start, end = offsets[first_a], offsets[last_a] + window_size
+            yield (file_a, start, end), (file_b, start + delta, end + delta)
+
+def clone_classes(pairs, min_occurrences=2):
+    """Group region pairs into clone classes that list every copy once.
+
+    Pairs are taken longest first. A side matches a known location of its
+    file when they overlap by at least half the longer of the two; a pair
+    with one matched side adds its other side to that location's class, and
+    one with neither side matched starts a new class. Pairs whose sides both
+    match, or lie inside locations of one class, add nothing, and classes
+    are never merged, so short snippets shared by unrelated clones don't
+    chain them together. A pair whose two sides overlap in one file is code
+    repeating itself shifted by a period, and is dropped.
+    Yields (tokens, [(file_id, start, end), ...]) in (file, start) order.
+    """
+    pairs = sorted(pairs, key=lambda pair: (pair[0][1] - pair[0][2], pair))
+    # Per file: (start, location) sorted by start, and the class of the
+    # first location covering each token (-1 for none).
+    starts = defaultdict(list)
+    covered = defaultdict(lambda: array('i'))
+    locations = []
+    classes = []
+
+    def match(file_id, start, end):
+        entries = starts[file_id]
+        length = end - start
+        for i in range(bisect_left(entries, (start - length,)), bisect_left(entries, (start + length,))):
+            _, location = entries[i]
+            _, other_start, other_end, _ = locations[location]
+            if 2 * (min(end, other_end) - max(start, other_start)) >= max(length, other_end - other_start):
+                return location
+        return None
+
+    def enclosing(file_id, start, end):
+        cover = covered[file_id]
+        if end > len(cover) or cover[start] < 0 or cover[start] != cover[end - 1]:
+            return None
+        return cover[start]
+
+    def add(side, class_id):
+        file_id, start, end = side
+        insort(starts[file_id], (start, len(locations)))
+        locations.append((file_id, start, end, class_id))
+        classes[class_id].append(side)
+        cover = covered[file_id]
+        if len(cover) < end:
+            cover.extend(array('i', [-1]) * (end - len(cover)))
+        for i in range(start, end):
+            if cover[i] < 0:
+                cover[i] = class_id
+
+    for region, copy in pairs:
+        if region[0] == copy[0] and region[1] < copy[2] and copy[1] < region[2]:
+            continue
+        inside = enclosing(*region)
+        if inside is not None and inside == enclosing(*copy):
+            continue
+        matched = [match(*region), match(*copy)]
+        if None not in matched:
+            continue
+        if matched == [None, None]:
+            classes.append([])
+            add(region, len(classes) - 1)
+            add(copy, len(classes) - 1)
+            continue
+        known, new = (matched[0], copy) if matched[0] is not None else (matched[1], region)
+        class_id = locations[known][3]
+        if enclosing(*new) != class_id:
+            add(new, class_id)
+
+    for members in classes:
+        if len(members) >= min_occurrences:
+            yield members[0][2] - members[0][1], sorted(members)
+
+def extract_templates(file_paths, window_size=10, min_occurrences=2, verify=False, jobs=1, index_path=None, guard=0):
+    """Find duplicated token regions of at least window_size tokens.
+
+    With guard > 0 only winnowed fingerprints are indexed; every duplicate
+    of at least window_size + guard - 1 tokens is still found.
+
+    Returns a list of {"tokens": length, "locations": [(path, token_index,
+    start_line, end_line), ...]}, longest first.
+    """
+    index = HashIndex()
+    file_lines = []
+    file_ids = []
+
+    cache = FingerprintCache(index_path, window_size) if index_path else None
+    try:
+        for path, hashes, lines, ids in scan_files(file_paths, window_size, verify, jobs, cache):
+            if guard > 1:
+                offsets = winnow(hashes, guard)
+                index.add(path, array('Q', (hashes[i] for i in offsets)), offsets)
+            else:
+                index.add(path, hashes)
+            file_lines.append(lines)
+            file_ids.append(ids)
+    finally:
+        if cache:
+            cache.close()
 
     # Filter by occurrence threshold
-    templates = {h: locs for h, locs in hash_map.items() if len(locs) >= min_occurrences}
+    groups = (group for _, positions in index.groups(min_occurrences)
+              for group in (split_collisions(index, positions, file_ids, window_size) if verify else [positions])
+              if len(group) >= min_occurrences)
+
+    templates = []
+    for tokens, members in clone_classes(clone_pairs(index, groups, window_size), min_occurrences):
+        locations = [(index.paths[f], start, file_lines[f][start], file_lines[f][end - 1])
+                     for f, start, end in members]
+        templates.append({"tokens": tokens, "locations": locations})
+    templates.sort(key=lambda template: (-template["tokens"], template["locations"]))
     return templates
 
 def main():
     parser = argparse.ArgumentParser(description="Detect templating opportunities across source files.")
-    parser.add_argument("files", nargs='+', help="List of source files to analyze")
+    parser.add_argument("paths", nargs='+', help="Source files or directories to analyze")
+    parser.add_argument("--ext", action="append", default=[], help="Only scan files with these extensions in directories (comma-separated, repeatable)")
+    parser.add_argument("--include", action="append", default=[], metavar="GLOB", help="Only scan directory files matching this glob (repeatable)")
+    parser.add_argument("--exclude", action="append", default=[], metavar="GLOB", help="Skip directory files matching this glob (repeatable)")
+    parser.add_argument("--max-size", type=int, default=1024 * 1024, help="Skip directory files larger than this many bytes")
     parser.add_argument("--window", type=int, default=10, help="Minimum token window size")
     parser.add_argument("--min", type=int, default=2, help="Minimum occurrences to consider a template")
+    parser.add_argument("--verify", action="store_true", help="Compare the tokens of hash matches to rule out collisions")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="Number of processes scanning files in parallel")
+    parser.add_argument("--index", metavar="PATH", help="SQLite file that keeps per-file fingerprints between runs, so only changed files are re-tokenized")
+    parser.add_argument("--winnow", type=int, default=0, metavar="W",
+                        help="Index only winnowed fingerprints (minimum hash of every W windows); finds every duplicate of at least window + W - 1 tokens")
     args = parser.parse_args()
+    for path in args.paths:
+        if not os.path.isdir(path) and not os.access(path, os.R_OK):
+            parser.error(f"cannot read {path}")
 
-    templates = extract_templates(args.files, args.window, args.min)
+    extensions = [ext for value in args.ext for ext in value.split(',') if ext]
+    files = discover_files(args.paths, extensions, args.include, args.exclude, args.max_size)
+    templates = extract_templates(files, args.window, args.min, args.verify, args.jobs, args.index, args.winnow)
 
     print(f"\n🔍 Found {len(templates)} templating opportunities:\n")
-    for h, locs in templates.items():
-        print(f"Template Hash: {h}")
-        for path, idx in locs:
-            print(f"  - {path} @ token index {idx}")
+    for template in templates:
+        print(f"Duplicated block of {template['tokens']} tokens:")
+        for path, idx, start_line, end_line in template["locations"]:
+            print(f"  - {path}:{start_line}-{end_line} @ token index {idx}")
         print()
 
 if __name__ == "__main__":